@@ -3,11 +3,15 @@ import sys
 import os
 import json
 import base64
+import urllib.error
+import urllib.parse
 import urllib.request
 import numpy as np
 import time
+import uuid
 from datetime import datetime
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
+import threading
 from threading import Lock
 from werkzeug.exceptions import HTTPException
 
@@ -27,6 +31,9 @@ state = {
     "running": False,
     "last_snapshot_metadata": None,
     "last_error": None,
+    "last_camera_frame_id": 0,
+    "stream_reader": None,
+    "coalescer": None,
     "lock": Lock()
 }
 
@@ -50,8 +57,8 @@ def load_config():
 # =====================================================
 # CAPTURAR FRAME DESDE MJPEG STREAM
 # =====================================================
-def get_frame_from_mjpeg(url: str):
-    """Lee UNA imagen JPG desde un stream MJPEG."""
+def get_jpeg_from_mjpeg(url: str):
+    """Lee UNA imagen JPG (sin decodificar) desde un stream MJPEG."""
     try:
         with urllib.request.urlopen(url, timeout=3) as resp:
             bytes_data = resp.read(250000)
@@ -65,52 +72,648 @@ def get_frame_from_mjpeg(url: str):
     if start == -1 or end == -1:
         return None
 
-    jpg = bytes_data[start:end + 2]
+    return bytes_data[start:end + 2]
 
-    # Decodificar
-    img_np = np.frombuffer(jpg, dtype=np.uint8)
-    frame = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
 
-    return frame
+# =====================================================
+# CAPTURAR FRAME DESDE /snapshot DEL SERVICIO DE CÁMARA
+# =====================================================
+def get_jpeg_from_snapshot(url: str, only_changed: bool = False, wait_sec: float = 5.0):
+    """
+    Pide el último JPEG ya codificado por la cámara (una request pequeña,
+    sin abrir el stream). Retorna (jpeg, info) o (None, None).
+
+    only_changed=True: pide el siguiente frame CON CAMBIOS posterior al último
+    usado; si la escena sigue quieta retorna (None, {"sin_cambios": True}).
+    """
+    timeout = 3
+    if only_changed:
+        with state["lock"]:
+            after = state["last_camera_frame_id"]
+        query = urllib.parse.urlencode({"changed": 1, "after": after, "wait": wait_sec})
+        url = f"{url}{'&' if '?' in url else '?'}{query}"
+        timeout += wait_sec
+
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            if resp.status == 204:
+                return None, {"sin_cambios": True}
+            jpg = resp.read()
+            info = {
+                "camera_frame_id": resp.headers.get("X-Frame-Id"),
+                "camera_captured_at": resp.headers.get("X-Capture-Timestamp"),
+                "camera_change_score": resp.headers.get("X-Change-Score") or None
+            }
+    except urllib.error.HTTPError:
+        return None, None
+    except Exception:
+        return None, None
+
+    try:
+        with state["lock"]:
+            state["last_camera_frame_id"] = int(info["camera_frame_id"])
+    except (TypeError, ValueError):
+        pass
+
+    return jpg, info
 
 
 # =====================================================
-# SNAPSHOT
+# LECTOR MJPEG PERSISTENTE
 # =====================================================
-def capture_snapshot():
-    url = state["config"].get("video_feed_url")
+class MultipartParser:
+    """
+    Parser incremental de multipart/x-mixed-replace.
+    feed() recibe chunks arbitrarios y devuelve las partes completas.
+    Usa Content-Length si viene; si no, corta en el siguiente boundary.
+    """
+
+    def __init__(self, boundary: bytes, max_part_bytes: int = 8 * 1024 * 1024):
+        self._delim = b"--" + boundary
+        self._max_part_bytes = max_part_bytes
+        self._buf = bytearray()
+        self._in_body = False
+        self._length = None
+        self._scan_from = 0
+
+    def feed(self, data: bytes):
+        self._buf += data
+        parts = []
+
+        while True:
+            if not self._in_body:
+                i = self._buf.find(self._delim)
+                if i == -1:
+                    # conservar solo lo que podría ser un boundary partido
+                    del self._buf[:max(0, len(self._buf) - len(self._delim))]
+                    break
+
+                h = self._buf.find(b"\r\n\r\n", i)
+                if h == -1:
+                    del self._buf[:i]
+                    break
+
+                self._length = self._content_length(bytes(self._buf[i + len(self._delim):h]))
+                del self._buf[:h + 4]
+                if self._length is not None and not 0 <= self._length <= self._max_part_bytes:
+                    # Content-Length corrupto o abusivo: descartar y resincronizar en el próximo boundary
+                    self._length = None
+                    continue
+
+                self._in_body = True
+                self._scan_from = 0
+
+            if self._length is not None:
+                if len(self._buf) < self._length:
+                    break
+                parts.append(bytes(self._buf[:self._length]))
+                del self._buf[:self._length]
+                self._in_body = False
+                continue
+
+            j = self._buf.find(self._delim, self._scan_from)
+            if j == -1:
+                if len(self._buf) > self._max_part_bytes:
+                    # parte corrupta o demasiado grande: descartar y resincronizar
+                    self._buf.clear()
+                    self._in_body = False
+                self._scan_from = max(0, len(self._buf) - len(self._delim))
+                break
+
+            body = bytes(self._buf[:j])
+            if body.endswith(b"\r\n"):
+                body = body[:-2]
+            parts.append(body)
+            del self._buf[:j]
+            self._in_body = False
+
+        return parts
+
+    @staticmethod
+    def _content_length(raw_headers: bytes):
+        for line in raw_headers.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                try:
+                    return int(value.strip())
+                except ValueError:
+                    return None
+        return None
+
 
-    frame = get_frame_from_mjpeg(url)
-    if frame is None:
+class MjpegStreamReader:
+    """
+    Mantiene UNA conexión larga al stream MJPEG en un hilo de fondo y
+    conserva en memoria solo el último JPEG completo. Reconecta con backoff.
+    """
+
+    def __init__(self, url: str, reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 10.0, read_timeout: float = 5.0):
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.read_timeout = read_timeout
+
+        self._lock = Lock()
+        self._jpeg = None
+        self._received_at = None
+        self._seq = 0
+        self.connected = False
+        self.reconnects = 0
+        self.last_error = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def latest(self):
+        """(jpeg, seq, received_at) del último frame completo, o (None, 0, None)."""
+        with self._lock:
+            return self._jpeg, self._seq, self._received_at
+
+    def stats(self):
+        with self._lock:
+            age = None if self._received_at is None else time.time() - self._received_at
+            return {
+                "connected": self.connected,
+                "reconnects": self.reconnects,
+                "frames": self._seq,
+                "frame_age_ms": None if age is None else round(age * 1000, 1),
+                "last_error": self.last_error
+            }
+
+    def _run(self):
+        delay = self.reconnect_delay
+
+        while True:
+            try:
+                with urllib.request.urlopen(self.url, timeout=self.read_timeout) as resp:
+                    boundary = self._boundary(resp.headers.get("Content-Type", ""))
+                    parser = MultipartParser(boundary)
+
+                    with self._lock:
+                        self.connected = True
+                        self.last_error = None
+                    delay = self.reconnect_delay
+
+                    while True:
+                        chunk = resp.read1(65536)
+                        if not chunk:
+                            raise ConnectionError("Stream MJPEG cerrado por el servidor")
+
+                        for part in parser.feed(chunk):
+                            if part.startswith(b"\xff\xd8"):
+                                with self._lock:
+                                    self._jpeg = part
+                                    self._seq += 1
+                                    self._received_at = time.time()
+
+            except Exception as e:
+                with self._lock:
+                    self.connected = False
+                    self.reconnects += 1
+                    self.last_error = str(e)
+
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    @staticmethod
+    def _boundary(content_type: str) -> bytes:
+        for param in content_type.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "boundary" and value:
+                value = value.strip('"')
+                return (value[2:] if value.startswith("--") else value).encode()
+        return b"frame"
+
+
+def get_jpeg_from_stream_reader():
+    """Responde desde el buffer del lector persistente (sin red). (jpeg, info) o (None, None)."""
+    reader = state["stream_reader"]
+    jpg, seq, received_at = reader.latest()
+    if jpg is None:
         return None, None
 
-    # Resize
-    canvas = state["config"].get("canvas_size", [512, 512])
-    frame = cv2.resize(frame, tuple(canvas))
+    age_sec = time.time() - received_at
+    max_age = state["config"].get("stream_max_frame_age_sec", 5)
+    info = {
+        "stream_frame_seq": seq,
+        "frame_age_ms": round(age_sec * 1000, 1),
+        "stale": age_sec > max_age,
+        "stream_connected": reader.connected
+    }
+
+    if info["stale"]:
+        # Nunca entregar como nueva una imagen congelada
+        return None, None
+
+    return jpg, info
 
-    # JPG
-    q_table = {"low": 30, "medium": 60, "high": 90}
-    quality = q_table.get(state["config"].get("quality", "medium"), 60)
 
-    ret, buffer = cv2.imencode(
-        ".jpg", frame,
-        [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+def fetch_jpeg(only_changed: bool = None):
+    """
+    Obtiene el JPEG de la cámara (sin decodificar) según capture_mode:
+    "snapshot" (por defecto), "stream" (lector persistente) o "mjpeg" (legado).
+    only_changed=None usa el valor de config.
+    """
+    cfg = state["config"]
+    mode = cfg.get("capture_mode", "snapshot")
+
+    if mode == "stream":
+        return get_jpeg_from_stream_reader()
+
+    if mode == "mjpeg":
+        return get_jpeg_from_mjpeg(cfg.get("video_feed_url")), {}
+
+    return get_jpeg_from_snapshot(
+        cfg.get("snapshot_url"),
+        only_changed=cfg.get("only_changed", False) if only_changed is None else only_changed,
+        wait_sec=cfg.get("changed_wait_sec", 5.0)
     )
 
-    if not ret:
+
+# =====================================================
+# SNAPSHOT
+# =====================================================
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+
+def jpeg_size(jpg: bytes):
+    """(ancho, alto) leyendo solo los marcadores del JPEG (sin decodificar), o None."""
+    i = 2
+    n = len(jpg)
+    while i + 9 < n:
+        if jpg[i] != 0xFF:
+            return None
+        marker = jpg[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            h = int.from_bytes(jpg[i + 5:i + 7], "big")
+            w = int.from_bytes(jpg[i + 7:i + 9], "big")
+            return (w, h) if w and h else None
+        i += 2 + int.from_bytes(jpg[i + 2:i + 4], "big")
+    return None
+
+
+def target_geometry(src, canvas, letterbox: bool):
+    """
+    Tamaño al que se escala el contenido y padding (izq, arriba) dentro del canvas.
+    Sin letterbox se estira a canvas (comportamiento histórico).
+    """
+    cw, ch = canvas
+    if not letterbox:
+        return (cw, ch), (0, 0)
+
+    sw, sh = src
+    scale = min(cw / sw, ch / sh)
+    w, h = max(1, round(sw * scale)), max(1, round(sh * scale))
+    return (w, h), ((cw - w) // 2, (ch - h) // 2)
+
+
+def decode_for_target(jpg: bytes, src, content):
+    """
+    Decodifica con IMREAD_REDUCED_* el mayor factor (8/4/2) que aún deja la imagen
+    >= tamaño destino; el IDCT escalado de libjpeg evita decodificar a resolución nativa.
+    Retorna (frame, factor).
+    """
+    if src is not None:
+        sw, sh = src
+        tw, th = content
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if sw // factor >= tw and sh // factor >= th:
+                frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), flag)
+                if frame is not None:
+                    return frame, factor
+
+    return cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR), 1
+
+
+# =====================================================
+# RÁFAGA (BURST) POR NITIDEZ
+# =====================================================
+REDUCED_GRAYSCALE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+]
+
+
+def sharpness_score(jpg: bytes, width: int = 256) -> float:
+    """
+    Varianza del Laplaciano sobre una versión en grises de ancho fijo
+    (el umbral no depende de la resolución de la cámara). Mayor = más nítida.
+    """
+    buf = np.frombuffer(jpg, dtype=np.uint8)
+    flag = cv2.IMREAD_GRAYSCALE
+    size = jpeg_size(jpg)
+    if size is not None:
+        for factor, reduced in REDUCED_GRAYSCALE_FLAGS:
+            if size[0] // factor >= width:
+                flag = reduced
+                break
+
+    gray = cv2.imdecode(buf, flag)
+    if gray is None:
+        return 0.0
+
+    if gray.shape[1] != width:
+        height = max(1, round(gray.shape[0] * width / gray.shape[1]))
+        gray = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+def capture_burst(frames: int):
+    """
+    Toma `frames` JPEG consecutivos distintos de la cámara y devuelve el más nítido.
+    Si todos quedan bajo burst.min_sharpness retorna (None, {"borroso": True, ...})
+    para que el orquestador no gaste inferencias en una imagen movida.
+    """
+    cfg_burst = state["config"].get("burst", {})
+    interval = cfg_burst.get("interval_ms", 40) / 1000.0
+    threshold = cfg_burst.get("min_sharpness", 0.0)
+    width = cfg_burst.get("score_width", 256)
+
+    best_jpg, best_info, best_score, best_idx = None, None, -1.0, 0
+    scores = []
+    seen = set()
+    score_sec = 0.0
+
+    for attempt in range(frames * 3):
+        if len(scores) >= frames:
+            break
+
+        # Solo el primero respeta only_changed; el resto es la ráfaga inmediata
+        jpg, info = fetch_jpeg(only_changed=None if attempt == 0 else False)
+        if jpg is None:
+            if attempt == 0:
+                return None, info
+            time.sleep(interval)
+            continue
+
+        key = info.get("camera_frame_id") or info.get("stream_frame_seq")
+        if key is not None:
+            if key in seen:
+                # La cámara aún no produjo un frame nuevo
+                time.sleep(interval)
+                continue
+            seen.add(key)
+
+        t = time.perf_counter()
+        score = sharpness_score(jpg, width)
+        score_sec += time.perf_counter() - t
+
+        if score > best_score:
+            best_jpg, best_info, best_score, best_idx = jpg, info, score, len(scores)
+        scores.append(round(score, 1))
+
+        if len(scores) < frames:
+            time.sleep(interval)
+
+    if best_jpg is None:
         return None, None
 
-    img_bytes = buffer.tobytes()
-    img_base64 = base64.b64encode(img_bytes).decode("utf-8")
+    burst = {
+        "frames": len(scores),
+        "scores": scores,
+        "selected": best_idx,
+        "min_sharpness": threshold,
+        "score_ms": round(score_sec * 1000, 2)
+    }
+
+    if best_score < threshold:
+        return None, {"borroso": True, "sharpness": round(best_score, 1), "burst": burst}
+
+    return best_jpg, {**best_info, "sharpness": round(best_score, 1), "burst": burst}
+
+
+def capture_snapshot(burst: int = None):
+    """
+    burst=None usa config (burst.enabled / burst.frames); burst<=1 desactiva la ráfaga.
+    """
+    cfg = state["config"]
+    cfg_burst = cfg.get("burst", {})
+    if burst is None:
+        burst = cfg_burst.get("frames", 5) if cfg_burst.get("enabled", False) else 1
+
+    t0 = time.perf_counter()
+    if burst > 1:
+        jpg, info = capture_burst(burst)
+    else:
+        jpg, info = fetch_jpeg()
+
+    if jpg is None:
+        return None, info
+
+    canvas = tuple(cfg.get("canvas_size", [512, 512]))
+    letterbox = cfg.get("resize_mode", "stretch") == "letterbox"
+
+    q_table = {"low": 30, "medium": 60, "high": 90}
+    quality = q_table.get(cfg.get("quality", "medium"), 60)
+
+    t_fetch = time.perf_counter()
+    src = jpeg_size(jpg)
+    timings = {"fetch_ms": round((t_fetch - t0) * 1000, 2)}
+
+    if src == canvas and cfg.get("passthrough_same_size", True):
+        # Ya viene al tamaño pedido: ni decode, ni resize, ni re-encode
+        img_bytes = jpg
+        resolution = canvas
+        extra = {"reencoded": False, "decode_factor": 0}
+    else:
+        content, pad = target_geometry(src, canvas, letterbox) if src else (canvas, (0, 0))
+        frame, factor = decode_for_target(jpg, src, content)
+        if frame is None:
+            return None, None
+
+        if src is None:
+            # Cabecera no legible: calcular geometría con el frame ya decodificado
+            src = (frame.shape[1], frame.shape[0])
+            content, pad = target_geometry(src, canvas, letterbox)
+
+        t_decode = time.perf_counter()
+
+        if (frame.shape[1], frame.shape[0]) != content:
+            frame = cv2.resize(frame, content)
+
+        if letterbox and content != canvas:
+            frame = cv2.copyMakeBorder(
+                frame, pad[1], canvas[1] - content[1] - pad[1],
+                pad[0], canvas[0] - content[0] - pad[0],
+                cv2.BORDER_CONSTANT, value=(0, 0, 0)
+            )
+
+        t_resize = time.perf_counter()
+
+        ret, buffer = cv2.imencode(
+            ".jpg", frame,
+            [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        )
+
+        if not ret:
+            return None, None
+
+        img_bytes = buffer.tobytes()
+        resolution = (frame.shape[1], frame.shape[0])
+
+        timings["decode_ms"] = round((t_decode - t_fetch) * 1000, 2)
+        timings["resize_ms"] = round((t_resize - t_decode) * 1000, 2)
+        timings["encode_ms"] = round((time.perf_counter() - t_resize) * 1000, 2)
+
+        extra = {"reencoded": True, "decode_factor": factor}
+        if letterbox:
+            # Para volver de coordenadas del canvas a las de la cámara:
+            # x_cam = (x - pad_x) / scale
+            extra["letterbox"] = {
+                "scale": round(content[0] / src[0], 6),
+                "pad": list(pad)
+            }
+
+    timings["total_ms"] = round((time.perf_counter() - t0) * 1000, 2)
 
     metadata = {
         "datetimepic": datetime.utcnow().isoformat() + "Z",
-        "resolution": f"{frame.shape[1]}x{frame.shape[0]}",
+        "resolution": f"{resolution[0]}x{resolution[1]}",
+        "source_resolution": f"{src[0]}x{src[1]}" if src else None,
         "size_bytes": len(img_bytes),
-        "format": "jpg"
+        "format": "jpg",
+        "timings": timings,
+        **extra,
+        **info
     }
 
-    return img_base64, metadata
+    return img_bytes, metadata
+
+
+# =====================================================
+# COALESCENCIA (SINGLE-FLIGHT)
+# =====================================================
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = 0.0
+
+
+class SnapshotCoalescer:
+    """
+    Llamadas concurrentes a /snapshot con la misma clave comparten UNA captura
+    en curso; un resultado terminado se reutiliza mientras tenga menos de
+    window_ms de antigüedad. Los fallos no se cachean (solo se comparten en vuelo).
+    """
+
+    def __init__(self, window_ms: float = 300):
+        self.window = window_ms / 1000.0
+        self._lock = Lock()
+        self._inflight = {}
+        self._recent = {}
+        self.hits = 0
+        self.shared_inflight = 0
+        self.misses = 0
+
+    def get(self, key, fn):
+        """Retorna (resultado, compartido)."""
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent and time.monotonic() - recent.finished_at <= self.window:
+                self.hits += 1
+                return recent.result, True
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.shared_inflight += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.finished_at = time.monotonic()
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._recent = {
+                    k: f for k, f in self._recent.items()
+                    if flight.finished_at - f.finished_at <= self.window
+                }
+                if flight.error is None and flight.result[0] is not None:
+                    self._recent[key] = flight
+            flight.done.set()
+
+        return flight.result, False
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.shared_inflight + self.misses
+            return {
+                "window_ms": round(self.window * 1000),
+                "hits": self.hits,
+                "shared_inflight": self.shared_inflight,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.shared_inflight) / total, 3) if total else None
+            }
+
+
+# =====================================================
+# NEGOCIACIÓN DE CONTENIDO
+# =====================================================
+SNAPSHOT_MIMETYPES = ["application/json", "image/jpeg", "multipart/mixed"]
+
+
+def build_multipart(metadata: dict, img_bytes: bytes) -> Response:
+    """multipart/mixed: parte JSON con la metadata + parte image/jpeg binaria."""
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(),
+        json.dumps(metadata).encode("utf-8"),
+        f"\r\n--{boundary}\r\nContent-Type: image/jpeg\r\n"
+        f"Content-Length: {len(img_bytes)}\r\n\r\n".encode(),
+        img_bytes,
+        f"\r\n--{boundary}--\r\n".encode()
+    ])
+    return Response(body, mimetype=f"multipart/mixed; boundary={boundary}")
+
+
+def snapshot_response(img_bytes: bytes, meta: dict):
+    """
+    Según el header Accept:
+    - image/jpeg: bytes crudos, metadata en X-Metadata (JSON)
+    - multipart/mixed: metadata JSON + JPEG en partes separadas
+    - application/json (por defecto, compatibilidad): imagen base64
+    """
+    best = request.accept_mimetypes.best_match(SNAPSHOT_MIMETYPES, default="application/json")
+
+    if best == "image/jpeg":
+        resp = Response(img_bytes, mimetype="image/jpeg")
+        resp.headers["X-Metadata"] = json.dumps(meta)
+        return resp
+
+    if best == "multipart/mixed":
+        return build_multipart(meta, img_bytes)
+
+    return jsonify({
+        "image": base64.b64encode(img_bytes).decode("utf-8"),
+        "metadata": meta
+    })
 
 
 # =====================================================
@@ -118,9 +721,28 @@ def capture_snapshot():
 # =====================================================
 @app.route("/snapshot", methods=["GET"])
 def snapshot():
-    img_base64, meta = capture_snapshot()
+    burst = request.args.get("burst", type=int)
 
-    if img_base64 is None:
+    coalescer = state["coalescer"]
+    if coalescer is not None:
+        (img_bytes, meta), shared = coalescer.get(burst, lambda: capture_snapshot(burst))
+        if shared and meta:
+            meta = {**meta, "coalesced": True}
+    else:
+        img_bytes, meta = capture_snapshot(burst)
+
+    if img_bytes is None and meta and meta.get("sin_cambios"):
+        # Escena quieta: no es un error, el llamador simplemente no infiere.
+        # 204 y no 304: el GET no es condicional (304 es para If-None-Match)
+        return Response(status=204, headers={"X-Sin-Cambios": "1"})
+
+    if img_bytes is None and meta and meta.get("borroso"):
+        # Toda la ráfaga movida: se descarta el ciclo en vez de inferir sobre blur
+        with state["lock"]:
+            state["last_snapshot_metadata"] = meta
+        return jsonify({"error": "Ráfaga bajo el umbral de nitidez", **meta}), 422
+
+    if img_bytes is None:
         with state["lock"]:
             state["last_error"] = "Error capturando snapshot"
 
@@ -130,10 +752,7 @@ def snapshot():
         state["last_snapshot_metadata"] = meta
         state["last_error"] = None
 
-    return jsonify({
-        "image": img_base64,
-        "metadata": meta
-    })
+    return snapshot_response(img_bytes, meta)
 
 
 # =====================================================
@@ -150,6 +769,8 @@ def status():
             "uptime_sec": round(time.time() - SERVICE_START_TIME, 2),
             "last_snapshot_metadata": state["last_snapshot_metadata"],
             "last_error": state["last_error"],
+            "stream_reader": state["stream_reader"].stats() if state["stream_reader"] else None,
+            "coalescing": state["coalescer"].stats() if state["coalescer"] else None,
             "timestamp": datetime.utcnow().isoformat()
         }), 200
 
@@ -179,6 +800,17 @@ def run_service():
     host = cfg.get("host", "0.0.0.0")
     port = cfg.get("service_port", 5002)
 
+    if cfg.get("capture_mode", "snapshot") == "stream":
+        state["stream_reader"] = MjpegStreamReader(
+            cfg.get("video_feed_url"),
+            reconnect_delay=cfg.get("stream_reconnect_delay_sec", 1.0),
+            max_reconnect_delay=cfg.get("stream_max_reconnect_delay_sec", 10.0)
+        )
+        state["stream_reader"].start()
+
+    if cfg.get("coalesce_window_ms", 300) > 0:
+        state["coalescer"] = SnapshotCoalescer(cfg.get("coalesce_window_ms", 300))
+
     print(f"📸 {SERVICE_NAME} escuchando en {host}:{port}")
     app.run(host=host, port=port, threaded=True, debug=False)
 
@@ -0,0 +1,95 @@
+"""
+Pruebas del parser incremental de multipart/x-mixed-replace (MjpegStreamReader).
+
+Uso:
+    python -m unittest test_multipart_parser
+"""
+import unittest
+
+from app import MultipartParser
+
+JPEG_A = b"\xff\xd8" + b"A" * 300 + b"\xff\xd9"
+JPEG_B = b"\xff\xd8" + b"B" * 200 + b"\xff\xd9"
+
+
+def part(jpeg, content_length=True):
+    """Mismo formato que build_part() del servicio de cámara."""
+    headers = b"--frame\r\nContent-Type: image/jpeg\r\n"
+    if content_length:
+        headers += f"Content-Length: {len(jpeg)}\r\n".encode()
+    return headers + b"\r\n" + jpeg + b"\r\n"
+
+
+def feed_in_chunks(parser, data, cuts):
+    parts = []
+    prev = 0
+    for cut in list(cuts) + [len(data)]:
+        parts += parser.feed(data[prev:cut])
+        prev = cut
+    return parts
+
+
+class MultipartParserTest(unittest.TestCase):
+
+    def test_parte_con_content_length_se_entrega_sin_esperar_boundary(self):
+        parser = MultipartParser(b"frame")
+        self.assertEqual(parser.feed(part(JPEG_A)), [JPEG_A])
+
+    def test_parte_sin_content_length_espera_el_siguiente_boundary(self):
+        parser = MultipartParser(b"frame")
+        self.assertEqual(parser.feed(part(JPEG_A, content_length=False)), [])
+        self.assertEqual(parser.feed(part(JPEG_B, content_length=False)), [JPEG_A])
+
+    def test_boundary_partido_entre_chunks(self):
+        stream = part(JPEG_A) + part(JPEG_B)
+        second = stream.index(b"--frame", 1)
+        for cut in range(second, second + len(b"--frame") + 1):
+            with self.subTest(cut=cut):
+                parser = MultipartParser(b"frame")
+                self.assertEqual(feed_in_chunks(parser, stream, [cut]), [JPEG_A, JPEG_B])
+
+    def test_headers_partidos_entre_chunks(self):
+        stream = part(JPEG_A) + part(JPEG_B)
+        head_end = stream.index(b"\r\n\r\n") + 4
+        for cut in range(1, head_end):
+            with self.subTest(cut=cut):
+                parser = MultipartParser(b"frame")
+                self.assertEqual(feed_in_chunks(parser, stream, [cut]), [JPEG_A, JPEG_B])
+
+    def test_boundary_partido_sin_content_length(self):
+        stream = part(JPEG_A, False) + part(JPEG_B, False) + b"--frame"
+        second = stream.index(b"--frame", 1)
+        for cut in range(second, second + len(b"--frame") + 1):
+            with self.subTest(cut=cut):
+                parser = MultipartParser(b"frame")
+                self.assertEqual(feed_in_chunks(parser, stream, [cut]), [JPEG_A, JPEG_B])
+
+    def test_byte_a_byte(self):
+        stream = part(JPEG_A) + part(JPEG_B)
+        parser = MultipartParser(b"frame")
+        self.assertEqual(feed_in_chunks(parser, stream, range(1, len(stream))), [JPEG_A, JPEG_B])
+
+    def test_basura_previa_al_primer_boundary(self):
+        parser = MultipartParser(b"frame")
+        self.assertEqual(parser.feed(b"xx\r\n" + part(JPEG_A)), [JPEG_A])
+
+    def test_parte_demasiado_grande_se_descarta_y_resincroniza(self):
+        parser = MultipartParser(b"frame", max_part_bytes=250)
+        self.assertEqual(parser.feed(part(JPEG_A, content_length=False)), [])
+        self.assertEqual(parser.feed(part(JPEG_B)), [JPEG_B])
+
+    def test_content_length_excesivo_se_descarta_y_resincroniza(self):
+        parser = MultipartParser(b"frame", max_part_bytes=1000)
+        hostil = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: 999999999\r\n\r\n" + JPEG_A + b"\r\n"
+        self.assertEqual(parser.feed(hostil), [])
+        self.assertEqual(parser.feed(part(JPEG_B)), [JPEG_B])
+        self.assertLess(len(parser._buf), 1000)
+
+    def test_content_length_negativo_se_descarta(self):
+        parser = MultipartParser(b"frame")
+        hostil = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: -5\r\n\r\n" + JPEG_A + b"\r\n"
+        self.assertEqual(parser.feed(hostil + part(JPEG_B)), [JPEG_B])
+
+
+if __name__ == "__main__":
+    unittest.main()
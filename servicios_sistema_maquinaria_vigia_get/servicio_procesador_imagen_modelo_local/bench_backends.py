@@ -0,0 +1,125 @@
+"""
+Benchmark: backend HTTP (servidor de inferencia en api_url) vs backend ONNX
+embebido (cv2.dnn en proceso).
+
+Ambos parten del mismo JPEG tal como llega a /procesar:
+- http: base64 + run_workflow (JSON/HTTP hacia el servidor de inferencia)
+- onnx: decode + OnnxDetector.detect sobre el ndarray
+
+Mide latencia por llamada (media, p50, p95) y throughput (imágenes/s) con
+distintos niveles de concurrencia. Si el servidor HTTP no está disponible se
+informa y se continúa con el backend ONNX.
+
+Uso:
+    python bench_backends.py --image muestra.jpg --n 50 --concurrency 1 4
+    python bench_backends.py --backends onnx --model modelos/detector.onnx
+"""
+import argparse
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app import OnnxDetector, base_dir, bytes_to_image, extract_predictions, load_config
+
+
+def load_jpeg(path, width, height):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    return cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])[1].tobytes()
+
+
+def make_http(cfg):
+    from inference_sdk import InferenceHTTPClient
+
+    client = InferenceHTTPClient(api_url=cfg["api_url"], api_key=cfg["roboflow_api_key"])
+
+    def run(jpg):
+        raw = client.run_workflow(
+            workspace_name=cfg["workspace_name"],
+            workflow_id=cfg["workflow_id"],
+            images={"image": base64.b64encode(jpg).decode("utf-8")},
+            use_cache=False
+        )
+        return extract_predictions(raw)
+
+    return run
+
+
+def make_onnx(cfg, model_path):
+    cfg_onnx = cfg.get("onnx", {})
+    detector = OnnxDetector(
+        model_path or os.path.join(base_dir(), cfg_onnx.get("model_path", "modelos/detector.onnx")),
+        input_size=cfg_onnx.get("input_size", 640),
+        conf_threshold=cfg_onnx.get("conf_threshold", 0.25),
+        nms_threshold=cfg_onnx.get("nms_threshold", 0.45),
+        class_names=cfg_onnx.get("class_names"),
+        output_format=cfg_onnx.get("output_format", "yolov8")
+    )
+
+    def run(jpg):
+        return extract_predictions(detector.detect(bytes_to_image(jpg)))
+
+    return run
+
+
+def measure(run, jpg, n, concurrency):
+    latencies = []
+
+    def one(_):
+        t0 = time.perf_counter()
+        run(jpg)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    run(jpg)  # calentamiento (primer forward / conexión)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    elapsed = time.perf_counter() - t0
+
+    lat = np.array(latencies)
+    return {
+        "mean_ms": lat.mean(),
+        "p50_ms": np.percentile(lat, 50),
+        "p95_ms": np.percentile(lat, 95),
+        "img_s": n / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", help="JPEG de prueba (por defecto uno sintético)")
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--n", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--backends", nargs="+", default=["http", "onnx"])
+    parser.add_argument("--model", help="Ruta del .onnx (por defecto la de config.json)")
+    args = parser.parse_args()
+
+    cfg = load_config()
+    jpg = load_jpeg(args.image, args.width, args.height)
+    print(f"JPEG de prueba: {len(jpg) / 1024:.1f} KB, n={args.n}")
+    print(f"{'backend':<8}{'conc':>6}{'media ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'img/s':>9}")
+
+    for name in args.backends:
+        try:
+            run = make_http(cfg) if name == "http" else make_onnx(cfg, args.model)
+            for conc in args.concurrency:
+                r = measure(run, jpg, args.n, conc)
+                print(f"{name:<8}{conc:>6}{r['mean_ms']:>11.1f}{r['p50_ms']:>10.1f}"
+                      f"{r['p95_ms']:>10.1f}{r['img_s']:>9.1f}")
+        except Exception as e:
+            print(f"{name:<8} no disponible: {e}")
+
+
+if __name__ == "__main__":
+    main()
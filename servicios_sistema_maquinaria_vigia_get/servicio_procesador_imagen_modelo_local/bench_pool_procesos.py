@@ -0,0 +1,112 @@
+"""
+Benchmark: etapas CPU-bound de /procesar (decode + draw + encode) en hilos del
+proceso principal vs ImageProcessPool (procesos hijos + memoria compartida).
+
+Cada imagen recorre el mismo pipeline que una request con la anotada pedida:
+- decode del JPEG
+- espera simulada de inferencia (--inference-ms, libera el GIL como el HTTP)
+- draw_predictions + encode JPEG
+
+Mide throughput (imágenes/s) con N procesos, de 1 hasta os.cpu_count(), y lo
+compara con la línea base en hilos. La ganancia solo aparece con varios
+núcleos: con uno solo el pool de procesos no puede superar a los hilos.
+
+Uso:
+    python bench_pool_procesos.py --n 64 --concurrency 8
+    python bench_pool_procesos.py --width 1280 --height 720 --procesos 1 2 4 8
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app import ImageProcessPool, bytes_to_image, draw_predictions, image_to_jpeg
+
+PREDICCIONES = [
+    {"x": 120 + 90 * i, "y": 300, "width": 60, "height": 110, "class": "diente", "confidence": 0.9}
+    for i in range(8)
+]
+
+
+def load_jpeg(path, width, height):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    return cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])[1].tobytes()
+
+
+def make_threads(inference_s):
+    def run(jpg):
+        img = bytes_to_image(jpg)
+        time.sleep(inference_s)
+        return image_to_jpeg(draw_predictions(img.copy(), PREDICCIONES))
+
+    return run
+
+
+def make_pool(pool, inference_s):
+    def run(jpg):
+        img, slot = pool.decode(jpg)
+        if img is None:
+            img = bytes_to_image(jpg)
+            time.sleep(inference_s)
+            return image_to_jpeg(draw_predictions(img.copy(), PREDICCIONES))
+        try:
+            time.sleep(inference_s)
+            return pool.render(slot, img.shape, PREDICCIONES)
+        finally:
+            pool.release(slot)
+
+    return run
+
+
+def measure(run, jpg, n, concurrency):
+    run(jpg)  # calentamiento
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: run(jpg), range(n)))
+    return n / (time.perf_counter() - t0)
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_procs = sorted({p for p in (1, 2, 4, 8) if p <= cores} | {cores})
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", help="JPEG de prueba (por defecto uno sintético)")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--n", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--inference-ms", type=float, default=0.0)
+    parser.add_argument("--procesos", type=int, nargs="+", default=default_procs)
+    args = parser.parse_args()
+
+    jpg = load_jpeg(args.image, args.width, args.height)
+    shape = bytes_to_image(jpg).shape
+    inference_s = args.inference_ms / 1000
+    print(f"JPEG de prueba: {shape[1]}x{shape[0]}, {len(jpg) / 1024:.1f} KB, "
+          f"n={args.n}, concurrencia={args.concurrency}, núcleos={cores}")
+    print(f"{'modo':<12}{'img/s':>9}{'speedup':>10}")
+
+    base = measure(make_threads(inference_s), jpg, args.n, args.concurrency)
+    print(f"{'hilos':<12}{base:>9.1f}{1.0:>10.2f}")
+
+    for procs in args.procesos:
+        pool = ImageProcessPool(procs, slots=args.concurrency, max_pixels=shape[0] * shape[1])
+        try:
+            r = measure(make_pool(pool, inference_s), jpg, args.n, args.concurrency)
+        finally:
+            pool.close()
+        print(f"{f'procesos={procs}':<12}{r:>9.1f}{r / base:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
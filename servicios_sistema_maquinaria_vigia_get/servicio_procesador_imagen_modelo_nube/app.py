@@ -2,11 +2,19 @@ import os
 import sys
 import json
 import base64
-import tempfile
+import atexit
+import hashlib
+import uuid
 import cv2
 import numpy as np
+import multiprocessing
+import queue
+import threading
 import time
-from flask import Flask, request, jsonify
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from flask import Flask, Response, g, request, jsonify
 from inference_sdk import InferenceHTTPClient
 from werkzeug.exceptions import HTTPException
 from threading import Lock
@@ -28,6 +36,10 @@ state = {
     "running": False,
     "last_result": None,
     "last_error": None,
+    "latency": {"requests": 0, "total_ms": 0.0, "inference_ms": 0.0, "last": None},
+    "cache": None,
+    "pool": None,
+    "image_pool": None,
     "lock": Lock()
 }
 
@@ -55,6 +67,34 @@ def init_client():
         api_key=cfg["roboflow_api_key"]
     )
 
+
+def init_pool():
+    cfg = state["config"]
+    if cfg.get("workers", 4) > 0:
+        state["pool"] = WorkerPool(cfg.get("workers", 4), cfg.get("max_queue", 16))
+
+
+def init_image_pool():
+    cfg = state["config"]
+    if cfg.get("image_processes", 0) > 0:
+        state["image_pool"] = ImageProcessPool(
+            cfg["image_processes"],
+            slots=cfg.get("image_process_slots", 8),
+            max_pixels=cfg.get("image_process_max_pixels", 1920 * 1080)
+        )
+        atexit.register(state["image_pool"].close)
+
+
+def init_cache():
+    cfg_cache = state["config"].get("cache", {})
+    if cfg_cache.get("enabled", False):
+        state["cache"] = ResultCache(
+            max_entries=cfg_cache.get("max_entries", 32),
+            ttl_sec=cfg_cache.get("ttl_sec", 30),
+            perceptual=cfg_cache.get("perceptual", False),
+            max_hamming=cfg_cache.get("max_hamming", 4)
+        )
+
 # =====================================================
 # UTILIDADES
 # =====================================================
@@ -68,12 +108,23 @@ def base64_to_image(b64_string):
         return None
 
 
-def image_to_base64(img):
+def image_to_jpeg(img):
     ok, buffer = cv2.imencode(".jpg", img)
     if not ok:
         raise RuntimeError("Error codificando imagen")
 
-    return base64.b64encode(buffer).decode("utf-8")
+    return buffer.tobytes()
+
+
+def image_to_base64(img):
+    return base64.b64encode(image_to_jpeg(img)).decode("utf-8")
+
+
+def bytes_to_image(data):
+    try:
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    except:
+        return None
 
 
 def extract_predictions(raw):
@@ -115,62 +166,794 @@ def draw_predictions(img, predictions):
     return img
 
 # =====================================================
-# ENDPOINT PRINCIPAL
+# POOL DE PROCESOS (decode / draw / encode fuera del GIL)
 # =====================================================
-@app.route("/procesar", methods=["POST"])
-def procesar():
-    data = request.get_json()
+_shm_adjuntos = {}
+
+
+def _adjuntar_shm(name):
+    """En el proceso hijo: adjunta (una vez) el slot de memoria compartida."""
+    shm = _shm_adjuntos.get(name)
+    if shm is None:
+        shm = _shm_adjuntos[name] = shared_memory.SharedMemory(name=name)
+    return shm
+
+
+def _ping():
+    return True
+
 
+def _decode_en_shm(data, name, capacity):
+    """Hijo: decodifica el JPEG directo al slot; devuelve el shape o None si es inválido."""
+    img = bytes_to_image(data)
+    if img is None:
+        return None
+    if img.nbytes > capacity:
+        raise ValueError(f"Imagen {img.shape} excede el slot de memoria compartida")
+
+    shm = _adjuntar_shm(name)
+    np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf)[:] = img
+    return img.shape
+
+
+def _render_desde_shm(name, shape, predictions):
+    """Hijo: dibuja sobre el slot (último uso de la imagen) y devuelve el JPEG."""
+    shm = _adjuntar_shm(name)
+    img = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    return image_to_jpeg(draw_predictions(img, predictions))
+
+
+class ImageProcessPool:
+    """
+    Etapas CPU-bound (decode y draw + encode) en procesos aparte. La imagen
+    decodificada vive en slots de memoria compartida preasignados: entre procesos
+    solo viajan el JPEG, el nombre del slot, el shape y las predicciones, nunca
+    el ndarray serializado. Sin slots libres (o imagen demasiado grande) se
+    decodifica en el proceso principal como antes.
+    """
+
+    def __init__(self, processes, slots=8, max_pixels=1920 * 1080):
+        self.processes = processes
+        self.slot_bytes = max_pixels * 3
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._shm = {}
+        self._free = queue.Queue()
+        for _ in range(slots):
+            shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+            self._shm[shm.name] = shm
+            self._free.put(shm.name)
+
+        self._lock = Lock()
+        self.decodes = 0
+        self.renders = 0
+        self.fallbacks = 0
+
+        # Levantar los procesos ahora y no en la primera request
+        for f in [self._executor.submit(_ping) for _ in range(processes)]:
+            f.result()
+
+    def decode(self, data):
+        """(img, slot) con img como vista sobre memoria compartida, o (None, None)."""
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            slot = None
+
+        shape = None
+        if slot is not None:
+            try:
+                shape = self._executor.submit(_decode_en_shm, data, slot, self.slot_bytes).result()
+            except Exception:
+                shape = None
+
+        with self._lock:
+            if shape is None:
+                self.fallbacks += 1
+            else:
+                self.decodes += 1
+
+        if shape is None:
+            if slot is not None:
+                self._free.put(slot)
+            return None, None
+
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._shm[slot].buf), slot
+
+    def render(self, slot, shape, predictions):
+        jpeg = self._executor.submit(_render_desde_shm, slot, shape, predictions).result()
+        with self._lock:
+            self.renders += 1
+        return jpeg
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for shm in self._shm.values():
+            try:
+                shm.close()
+                shm.unlink()
+            except (BufferError, FileNotFoundError):
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "slots": len(self._shm),
+                "slots_free": self._free.qsize(),
+                "slot_mb": round(self.slot_bytes / (1024 * 1024), 1),
+                "decodes": self.decodes,
+                "renders": self.renders,
+                "fallbacks": self.fallbacks
+            }
+
+
+def decode_jpeg(data):
+    """(img, slot); slot es None si se decodificó en el proceso principal."""
+    pool = state["image_pool"]
+    if pool is not None:
+        img, slot = pool.decode(data)
+        if img is not None:
+            return img, slot
+    return bytes_to_image(data), None
+
+
+def decode_request_image(data):
+    """Decode de la imagen de /procesar; el slot se libera en teardown_request."""
+    img, slot = decode_jpeg(data)
+    if slot is not None:
+        g.shm_slot = slot
+    return img
+
+
+@app.teardown_request
+def liberar_slot_imagen(_exc):
+    slot = g.pop("shm_slot", None)
+    if slot is not None:
+        state["image_pool"].release(slot)
+
+
+# =====================================================
+# NEGOCIACIÓN DE CONTENIDO
+# =====================================================
+PROCESAR_MIMETYPES = ["application/json", "multipart/mixed", "image/jpeg"]
+INCLUDE_OPCIONES = ("predicciones", "anotada", "raw")
+
+
+def parse_include(options):
+    """
+    Campos de la respuesta (?include= / ?fields= o "include" en el cuerpo):
+    "predicciones" (siempre), "anotada" (imagen anotada en base64), "raw" (salida
+    completa del workflow). Sin el parámetro se devuelve todo (compatibilidad).
+    """
+    value = (
+        request.args.get("include") or request.args.get("fields")
+        or options.get("include") or options.get("fields")
+    )
+    if not value:
+        return set(INCLUDE_OPCIONES)
+
+    if isinstance(value, str):
+        value = value.split(",")
+
+    include = {str(v).strip() for v in value} & set(INCLUDE_OPCIONES)
+    include.add("predicciones")
+    return include
+
+
+def read_image_request():
+    """
+    Imagen de entrada según Content-Type:
+    - image/jpeg: cuerpo binario (sin base64)
+    - multipart/form-data: parte "image" (JPEG) + parte "metadata" (JSON, opcional)
+    - application/json (compatibilidad): {"image": "<base64>", ...}
+    Devuelve (img, jpeg_base64, opciones, error); jpeg_base64 es el JPEG original
+    tal cual llegó, listo para run_workflow sin re-encode.
+    """
+    if request.mimetype == "image/jpeg":
+        data = request.get_data()
+        img = decode_request_image(data)
+        image_b64 = base64.b64encode(data).decode("utf-8")
+        return img, image_b64, dict(request.args), None if img is not None else "Imagen JPEG inválida"
+
+    if request.mimetype == "multipart/form-data":
+        part = request.files.get("image")
+        if part is None:
+            return None, None, {}, "Falta parte 'image'"
+        try:
+            options = json.loads(request.form.get("metadata") or "{}")
+        except ValueError:
+            return None, None, {}, "Parte 'metadata' no es JSON válido"
+        data = part.read()
+        img = decode_request_image(data)
+        image_b64 = base64.b64encode(data).decode("utf-8")
+        return img, image_b64, options, None if img is not None else "Imagen JPEG inválida"
+
+    data = request.get_json(silent=True)
     if not data or "image" not in data:
-        return jsonify({"error": "Falta campo 'image'"}), 400
+        return None, None, {}, "Falta campo 'image'"
+
+    try:
+        jpeg = base64.b64decode(data["image"])
+    except (ValueError, TypeError):
+        jpeg = b""
+    img = decode_request_image(jpeg) if jpeg else None
+    options = {k: v for k, v in data.items() if k != "image"}
+    return img, data["image"], options, None if img is not None else "Imagen base64 inválida"
+
+
+def build_multipart(result, jpeg_bytes):
+    """multipart/mixed: parte JSON con el resultado + parte image/jpeg anotada."""
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(),
+        json.dumps(result).encode("utf-8"),
+        f"\r\n--{boundary}\r\nContent-Type: image/jpeg\r\n"
+        f"Content-Length: {len(jpeg_bytes)}\r\n\r\n".encode(),
+        jpeg_bytes,
+        f"\r\n--{boundary}--\r\n".encode()
+    ])
+    return Response(body, mimetype=f"multipart/mixed; boundary={boundary}")
+
+
+def negotiate_response():
+    return request.accept_mimetypes.best_match(PROCESAR_MIMETYPES, default="application/json")
+
+
+def procesar_response(result, annotated_jpeg, include, best):
+    """
+    Según el header Accept (best = negotiate_response()):
+    - application/json (por defecto): campos según include
+    - multipart/mixed: resultado JSON + JPEG anotado binario
+    - image/jpeg: JPEG anotado; predicciones en X-Predicciones / X-Count
+    Devuelve (respuesta, resultado a guardar como last_result).
+    """
+    if best == "image/jpeg":
+        resp = Response(annotated_jpeg, mimetype="image/jpeg")
+        resp.headers["X-Count"] = str(result["count"])
+        resp.headers["X-Predicciones"] = json.dumps(result["predicciones"])
+        resp.headers["X-Timings"] = json.dumps(result["timings"])
+        resp.headers["X-Cache"] = result["cache"] or "miss"
+        return resp, result
+
+    if best == "multipart/mixed":
+        return build_multipart(shape_result(result, None, include - {"anotada"}), annotated_jpeg), result
+
+    result = shape_result(result, annotated_jpeg, include)
+    return jsonify(result), result
+
+
+def shape_result(result, annotated_jpeg, include):
+    """Resultado JSON con solo los campos pedidos en include."""
+    shaped = {
+        "predicciones": result["predicciones"],
+        "count": result["count"]
+    }
+    if "anotada" in include:
+        shaped["imagen"] = base64.b64encode(annotated_jpeg).decode("utf-8")
+    if "raw" in include:
+        shaped["raw"] = result["raw"]
+
+    shaped["timings"] = result["timings"]
+    shaped["cache"] = result["cache"]
+    return shaped
 
-    tmp_path = None
 
+# =====================================================
+# POOL DE WORKERS + CONTROL DE ADMISIÓN
+# =====================================================
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+
+class PlazoVencido(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, fn, deadline):
+        self.fn = fn
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.wait_ms = None
+        self.result = None
+        self.error = None
+        self.expired = False
+        self.done = threading.Event()
+
+
+class WorkerPool:
+    """
+    Número fijo de workers consumiendo una cola acotada: run_workflow nunca
+    corre en más de `workers` hilos a la vez. Cola llena -> queue.Full (el
+    endpoint responde 503 + Retry-After). Un job cuyo plazo venció mientras
+    esperaba se descarta sin ejecutarse.
+    """
+
+    def __init__(self, workers=4, max_queue=16):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = Lock()
+        self.busy = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.service_ms_total = 0.0
+
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"worker-{i}", daemon=True).start()
+
+    def submit(self, fn, deadline=None, block=False):
+        job = _Job(fn, deadline)
+        try:
+            self._queue.put(job, block=block)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+        with self._lock:
+            self.submitted += 1
+        return job
+
+    def run(self, fn, deadline=None, block=False):
+        """submit + esperar. Devuelve (resultado, wait_ms); PlazoVencido si se descartó."""
+        job = self.submit(fn, deadline, block)
+        job.done.wait()
+        if job.expired:
+            raise PlazoVencido("Plazo vencido antes de empezar a procesar")
+        if job.error is not None:
+            raise job.error
+        return job.result, job.wait_ms
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            started = time.monotonic()
+            job.wait_ms = round((started - job.enqueued) * 1000, 2)
+
+            with self._lock:
+                self.wait_ms_total += job.wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, job.wait_ms)
+                if job.deadline is not None and started >= job.deadline:
+                    self.expired += 1
+                    job.expired = True
+                else:
+                    self.busy += 1
+
+            if not job.expired:
+                try:
+                    job.result = job.fn()
+                except Exception as e:
+                    job.error = e
+                with self._lock:
+                    self.busy -= 1
+                    self.completed += 1
+                    self.service_ms_total += (time.monotonic() - started) * 1000
+
+            job.done.set()
+
+    def retry_after(self):
+        """Segundos estimados hasta que se libere la cola (mínimo 1)."""
+        with self._lock:
+            avg_ms = self.service_ms_total / self.completed if self.completed else 1000.0
+        return max(1, int(np.ceil(self._queue.qsize() * avg_ms / self.workers / 1000)))
+
+    def stats(self):
+        with self._lock:
+            started = self.completed + self.busy + self.expired
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "avg_wait_ms": round(self.wait_ms_total / started, 2) if started else None,
+                "max_wait_ms": round(self.wait_ms_max, 2)
+            }
+
+
+def parse_deadline():
+    """
+    X-Deadline-Ms: presupuesto (ms) que le queda al cliente al enviar la request.
+    Relativo a propósito: no depende de relojes sincronizados entre equipos.
+    """
+    value = request.headers.get(DEADLINE_HEADER)
+    if not value:
+        return None
     try:
-        img = base64_to_image(data["image"])
-        if img is None:
-            return jsonify({"error": "Imagen base64 inválida"}), 400
+        return time.monotonic() + float(value) / 1000.0
+    except ValueError:
+        return None
 
-        # Guardar temporal
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-        cv2.imwrite(tmp.name, img)
-        tmp_path = tmp.name
 
-        # Ejecutar inferencia local
-        cfg = state["config"]
+def ejecutar(fn, deadline=None, block=False):
+    """Corre fn en el pool (o en línea si workers=0). Devuelve (resultado, wait_ms)."""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise PlazoVencido("Plazo vencido antes de encolar")
+    if state["pool"] is None:
+        return fn(), 0.0
+    return state["pool"].run(fn, deadline, block)
+
+
+def sobrecarga_response():
+    pool = state["pool"]
+    resp = jsonify({"error": "Cola de inferencia llena", "queue_depth": pool.max_queue})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(pool.retry_after())
+    return resp
+
+
+# =====================================================
+# CACHÉ DE RESULTADOS
+# =====================================================
+def dhash(img):
+    """Hash perceptual (dHash) de 64 bits: gradiente horizontal sobre 9x8 en grises."""
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class ResultCache:
+    """
+    LRU + TTL de salidas de run_workflow.
+    Clave exacta: sha256 del JPEG. Opcional: dHash con distancia de Hamming
+    <= max_hamming (frames casi idénticos con la pala detenida).
+    """
+
+    def __init__(self, max_entries=32, ttl_sec=30, perceptual=False, max_hamming=4):
+        self.max_entries = max_entries
+        self.ttl = ttl_sec
+        self.perceptual = perceptual
+        self.max_hamming = max_hamming
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.hits_exact = 0
+        self.hits_perceptual = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def lookup(self, image_b64, img):
+        """Devuelve (key, phash, (raw, tipo) | None)."""
+        key = hashlib.sha256(image_b64.encode("ascii")).hexdigest()
+        phash = dhash(img) if self.perceptual else None
+        now = time.monotonic()
+
+        with self._lock:
+            for k in [k for k, e in self._entries.items() if now - e["created"] > self.ttl]:
+                del self._entries[k]
+
+            kind = "exact"
+            if key not in self._entries and phash is not None:
+                key_near, dist = None, self.max_hamming + 1
+                for k, e in self._entries.items():
+                    d = bin(e["phash"] ^ phash).count("1")
+                    if d < dist:
+                        key_near, dist = k, d
+                if key_near is None:
+                    self.misses += 1
+                    return key, phash, None
+                key, kind = key_near, "perceptual"
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return key, phash, None
+
+            self._entries.move_to_end(key)
+            if kind == "exact":
+                self.hits_exact += 1
+            else:
+                self.hits_perceptual += 1
+            self.saved_ms += entry["inference_ms"]
+            return key, phash, (entry["raw"], kind)
+
+    def put(self, key, phash, raw, inference_ms):
+        with self._lock:
+            self._entries[key] = {
+                "created": time.monotonic(),
+                "phash": phash,
+                "raw": raw,
+                "inference_ms": inference_ms
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_exact + self.hits_perceptual
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl,
+                "perceptual": self.perceptual,
+                "hits_exact": self.hits_exact,
+                "hits_perceptual": self.hits_perceptual,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 3) if total else None,
+                "saved_ms": round(self.saved_ms, 1)
+            }
+
+
+# =====================================================
+# MÉTRICAS DE LATENCIA
+# =====================================================
+def record_latency(timings):
+    """Acumula tiempos por request (llamar con state["lock"] tomado)."""
+    lat = state["latency"]
+    lat["requests"] += 1
+    lat["total_ms"] += timings["total_ms"]
+    lat["inference_ms"] += timings["inference_ms"]
+    lat["last"] = timings
+
+
+def latency_stats():
+    lat = state["latency"]
+    n = lat["requests"]
+    return {
+        "requests": n,
+        "avg_total_ms": round(lat["total_ms"] / n, 2) if n else None,
+        "avg_inference_ms": round(lat["inference_ms"] / n, 2) if n else None,
+        "last": lat["last"]
+    }
+
+
+# =====================================================
+# ENDPOINT PRINCIPAL
+# =====================================================
+def consultar_cache(img, image_b64):
+    """
+    Lookup en la caché de resultados, en el hilo de la request y ANTES de la
+    admisión al pool: un hit no ocupa lugar en la cola ni puede recibir 503/504.
+    Devuelve (key, phash, cached); cached es None si no hay hit.
+    """
+    cache = state["cache"]
+    if cache is None:
+        return None, None, None
+    return cache.lookup(image_b64, img)
+
+
+def inferir(img, image_b64, decode_ms, consulta=None):
+    """
+    run_workflow + predicciones sobre una imagen ya decodificada (sin render).
+    decode_ms se mide en el hilo de la request, antes de encolar.
+    consulta: resultado previo de consultar_cache() (si no, se consulta aquí).
+    """
+    t_decode = time.perf_counter()
+    cfg = state["config"]
+
+    cache = state["cache"]
+    key, phash, cached = consulta if consulta is not None else consultar_cache(img, image_b64)
+
+    if cached is not None:
+        # Misma imagen (o casi) hace poco: sin run_workflow
+        raw, cache_hit = cached
+    else:
+        # El JPEG original va directo en base64: sin archivo temporal ni re-encode
         raw = state["client"].run_workflow(
             workspace_name=cfg["workspace_name"],
             workflow_id=cfg["workflow_id"],
-            images={"image": tmp_path},
+            images={"image": image_b64},
             use_cache=False
         )
+        cache_hit = None
+
+    t_inference = time.perf_counter()
 
-        predictions = extract_predictions(raw)
-        annotated = draw_predictions(img.copy(), predictions)
-        annotated_b64 = image_to_base64(annotated)
+    if cache is not None and cached is None:
+        cache.put(key, phash, raw, (t_inference - t_decode) * 1000)
+
+    predictions = extract_predictions(raw)
+
+    timings = {
+        "decode_ms": decode_ms,
+        "inference_ms": round((t_inference - t_decode) * 1000, 2)
+    }
+
+    result = {
+        "predicciones": predictions,
+        "count": len(predictions),
+        "raw": raw,
+        "timings": timings,
+        "cache": cache_hit
+    }
+
+    return result
+
+
+def render_annotated(img, result, slot=None):
+    """
+    Dibuja y codifica la imagen anotada; solo se llama si alguien la pidió.
+    Con slot (pool de procesos) se dibuja en el hijo sobre la memoria compartida.
+    """
+    t = time.perf_counter()
+    if slot is not None:
+        annotated_jpeg = state["image_pool"].render(slot, img.shape, result["predicciones"])
+    else:
+        annotated_jpeg = image_to_jpeg(draw_predictions(img.copy(), result["predicciones"]))
+    result["timings"]["render_ms"] = round((time.perf_counter() - t) * 1000, 2)
+    return annotated_jpeg
+
+
+def finalizar(result, t0):
+    result["timings"]["total_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    with state["lock"]:
+        record_latency(result["timings"])
+
+
+@app.route("/procesar", methods=["POST"])
+def procesar():
+    t0 = time.perf_counter()
 
-        result = {
-            "predicciones": predictions,
-            "count": len(predictions),
-            "imagen": annotated_b64,
-            "raw": raw
-        }
+    try:
+        img, image_b64, options, error = read_image_request()
+        if img is None:
+            return jsonify({"error": error}), 400
+
+        decode_ms = round((time.perf_counter() - t0) * 1000, 2)
+        slot = g.get("shm_slot")
+        include = parse_include(options)
+        best = negotiate_response()
+        if best != "application/json":
+            include.add("anotada")
+
+        consulta = consultar_cache(img, image_b64)
+
+        def trabajo():
+            result = inferir(img, image_b64, decode_ms, consulta)
+            annotated_jpeg = render_annotated(img, result, slot) if "anotada" in include else None
+            finalizar(result, t0)
+            return result, annotated_jpeg
+
+        if consulta[2] is not None:
+            # Hit de caché: se responde directo, sin pasar por la admisión del pool
+            (result, annotated_jpeg), wait_ms = trabajo(), 0.0
+        else:
+            try:
+                (result, annotated_jpeg), wait_ms = ejecutar(trabajo, parse_deadline())
+            except queue.Full:
+                return sobrecarga_response()
+            except PlazoVencido as e:
+                return jsonify({"error": str(e)}), 504
+
+        result["timings"]["queue_ms"] = wait_ms
+        response, result = procesar_response(result, annotated_jpeg, include, best)
 
         with state["lock"]:
             state["last_result"] = result
             state["last_error"] = None
 
-        return jsonify(result), 200
+        return response, 200
 
     except Exception as e:
         with state["lock"]:
             state["last_error"] = str(e)
         return jsonify({"error": str(e)}), 500
 
+
+# =====================================================
+# ENDPOINT LOTE
+# =====================================================
+def read_lote_request():
+    """
+    Lista de imágenes del lote:
+    - application/json: {"images": ["<base64>" | {"id": ..., "image": "<base64>"}, ...]}
+    - multipart/form-data: varias partes "image" (JPEG); el id es el nombre de archivo
+    Devuelve (items, opciones, error) con items = [(id, jpeg_base64), ...].
+    """
+    if request.mimetype == "multipart/form-data":
+        return [
+            (part.filename or i, base64.b64encode(part.read()).decode("utf-8"))
+            for i, part in enumerate(request.files.getlist("image"))
+        ], {}, None
+
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get("images"), list):
+        return None, {}, "Falta lista 'images'"
+
+    items = []
+    for i, entry in enumerate(data["images"]):
+        if isinstance(entry, dict):
+            items.append((entry.get("id", i), entry.get("image")))
+        else:
+            items.append((i, entry))
+
+    options = {k: v for k, v in data.items() if k != "images"}
+    return items, options, None
+
+
+def procesar_item(index, item_id, image_b64, include, deadline):
+    """
+    Un elemento del lote; los errores se reportan en la línea, no abortan el lote.
+    Pasa por el mismo pool que /procesar, esperando lugar en la cola en vez de rechazar.
+    """
+    t0 = time.perf_counter()
+    base = {"index": index, "id": item_id}
+    slot = None
+
+    try:
+        try:
+            jpeg = base64.b64decode(image_b64) if isinstance(image_b64, str) else b""
+        except ValueError:
+            jpeg = b""
+        img, slot = decode_jpeg(jpeg) if jpeg else (None, None)
+        if img is None:
+            return {**base, "ok": False, "error": "Imagen base64 inválida"}
+
+        decode_ms = round((time.perf_counter() - t0) * 1000, 2)
+        consulta = consultar_cache(img, image_b64)
+
+        def trabajo():
+            result = inferir(img, image_b64, decode_ms, consulta)
+            annotated_jpeg = render_annotated(img, result, slot) if "anotada" in include else None
+            finalizar(result, t0)
+            return result, annotated_jpeg
+
+        if consulta[2] is not None:
+            (result, annotated_jpeg), wait_ms = trabajo(), 0.0
+        else:
+            (result, annotated_jpeg), wait_ms = ejecutar(trabajo, deadline, block=True)
+        result["timings"]["queue_ms"] = wait_ms
+        return {**base, "ok": True, **shape_result(result, annotated_jpeg, include)}
+
+    except Exception as e:
+        return {**base, "ok": False, "error": str(e)}
+
     finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try: os.remove(tmp_path)
-            except: pass
+        if slot is not None:
+            state["image_pool"].release(slot)
+
+
+@app.route("/procesar_lote", methods=["POST"])
+def procesar_lote():
+    """
+    Procesa el lote con hasta `batch_parallelism` run_workflow concurrentes y
+    devuelve NDJSON: una línea por imagen, en el orden de entrada, apenas está lista.
+    """
+    items, options, error = read_lote_request()
+    if items is None:
+        return jsonify({"error": error}), 400
+
+    include = parse_include(options)
+    deadline = parse_deadline()
+
+    cfg = state["config"]
+    max_items = cfg.get("batch_max_images", 64)
+    if len(items) > max_items:
+        return jsonify({"error": f"Lote de {len(items)} imágenes supera el máximo ({max_items})"}), 413
+
+    if not items:
+        return Response("", mimetype="application/x-ndjson")
+
+    workers = max(1, min(cfg.get("batch_parallelism", 4), len(items)))
+
+    def generate():
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lote")
+        try:
+            futures = [
+                pool.submit(procesar_item, i, item_id, image_b64, include, deadline)
+                for i, (item_id, image_b64) in enumerate(items)
+            ]
+            for future in futures:
+                yield json.dumps(future.result()) + "\n"
+        finally:
+            # Cliente desconectado: no seguir gastando inferencias
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
 
 # =====================================================
 # STATUS UNIFICADO (GUI MONITOR)
@@ -185,6 +968,10 @@ def status():
             "status": "ok" if state["last_error"] is None else "error",
             "last_result": state["last_result"],
             "last_error": state["last_error"],
+            "latency": latency_stats(),
+            "cache": state["cache"].stats() if state["cache"] else None,
+            "worker_pool": state["pool"].stats() if state["pool"] else None,
+            "image_pool": state["image_pool"].stats() if state["image_pool"] else None,
             "uptime_sec": round(time.time() - SERVICE_START_TIME, 2)
         })
 
@@ -208,6 +995,9 @@ def handle_exception(e):
 def run_service():
     state["config"] = load_config()
     init_client()
+    init_cache()
+    init_pool()
+    init_image_pool()
     state["running"] = True
 
     cfg = state["config"]
@@ -223,4 +1013,6 @@ def run_service():
 
 
 if __name__ == "__main__":
+    # Ejecutable congelado: los hijos "spawn" del pool de procesos no deben relanzar el servicio
+    multiprocessing.freeze_support()
     run_service()
@@ -1,3 +1,4 @@
+import base64
 import json
 import logging
 import threading
@@ -59,11 +60,19 @@ def contar_dientes(predicciones: Any) -> int:
     return len(predicciones) if isinstance(predicciones, list) else 0
 
 
-def llamar_servicio(method: str, url: str, *, json_body=None, timeout=30):
-    """HTTP con reintentos infinitos (estandarizado)."""
-    espera = config.get("retry_delay_seconds", 2)
+def llamar_servicio(method: str, url: str, *, json_body=None, data=None, headers=None,
+                    raw=False, aceptar=(), timeout=30):
+    """
+    HTTP con reintentos infinitos (estandarizado).
+    raw=True devuelve la respuesta completa (cuerpo binario + headers) en vez de resp.json().
+    aceptar: códigos no-2xx que se devuelven (como respuesta completa) sin reintentar.
+    Envía X-Deadline-Ms=timeout para que el servicio descarte trabajo que ya nadie espera
+    y respeta Retry-After cuando el servicio responde 429/503 por sobrecarga.
+    """
+    headers = {**(headers or {}), "X-Deadline-Ms": str(int(timeout * 1000))}
 
     while True:
+        espera = config.get("retry_delay_seconds", 2)
         try:
             logger.info(f"[HTTP] {method} {url}")
 
@@ -71,16 +80,24 @@ def llamar_servicio(method: str, url: str, *, json_body=None, timeout=30):
                 method=method.upper(),
                 url=url,
                 json=json_body,
+                data=data,
+                headers=headers,
                 timeout=timeout
             )
 
             if 200 <= resp.status_code < 300:
                 with state["lock"]:
                     state["last_success"] = _ts()
-                return resp.json()
+                return resp if raw else resp.json()
+
+            if resp.status_code in aceptar:
+                return resp
 
             logger.warning(f"Respuesta no exitosa {resp.status_code}: {resp.text}")
 
+            if resp.status_code in (429, 503) and resp.headers.get("Retry-After", "").isdigit():
+                espera = int(resp.headers["Retry-After"])
+
         except Exception as e:
             with state["lock"]:
                 state["last_error"] = f"{_ts()} - {e}"
@@ -105,16 +122,38 @@ def encender_sirena():
         state["last_error"] = str(e)
 
 
+def solicitar_clip_incidente():
+    """Pide a la cámara exportar los segundos previos al incidente (no bloquea el ciclo)."""
+    cfg_clip = config.get("clip_incidente", {})
+    if not cfg_clip.get("habilitado", False):
+        return None
+
+    try:
+        servicios = config["services"]
+        url = (
+            servicios["servicio_transmision_camara"]
+            + servicios["servicio_transmision_camara_rutas"][2]
+        )
+        resp = requests.post(
+            url,
+            json={"seconds": cfg_clip.get("segundos", 10), "format": cfg_clip.get("formato", "mjpeg")},
+            timeout=5
+        )
+        resp.raise_for_status()
+        clip = resp.json()
+        logger.info(f"Clip de incidente solicitado: {clip.get('clip_id')}")
+        return clip
+    except Exception as e:
+        logger.error(f"Error solicitando clip de incidente: {e}")
+        return None
+
+
 # ============================================================
 # ESTADO DEL CICLO INTERNO (igual al tuyo, pero ordenado)
 # ============================================================
 class EstadoInterno:
     def __init__(self):
-        self.numero_ciclo = 0
-        self.recurrencia = {
-            "ciclos_falla_consecutiva": 0,
-            "reportes_enviados": 0,
-        }
+        self.reiniciar()
 
     def reiniciar(self):
         self.numero_ciclo = 0
@@ -122,6 +161,12 @@ class EstadoInterno:
             "ciclos_falla_consecutiva": 0,
             "reportes_enviados": 0,
         }
+        self.cascada = {
+            "ciclos": 0,
+            "escalados": 0,
+            "latencia_nube_ms": None,   # media móvil de la llamada a la nube
+            "latencia_ahorrada_ms": 0.0,
+        }
 
 
 estado_interno = EstadoInterno()
@@ -131,12 +176,13 @@ estado_interno = EstadoInterno()
 # INDICADORES
 # ============================================================
 def construir_indicadores(expected, local, nube):
+    """nube=None: la cascada no consultó la nube (el local vio todos los dientes)."""
     umbral = config.get("min_consecutive_missing_cycles", 2)
 
     faltan_local = expected - local
-    faltan_nube = expected - nube
+    faltan_nube = expected - nube if nube is not None else None
 
-    falta_ambos = faltan_local > 0 and faltan_nube > 0
+    falta_ambos = faltan_local > 0 and faltan_nube is not None and faltan_nube > 0
 
     if falta_ambos:
         estado_interno.recurrencia["ciclos_falla_consecutiva"] += 1
@@ -158,6 +204,66 @@ def construir_indicadores(expected, local, nube):
     }
 
 
+# ============================================================
+# CASCADA LOCAL → NUBE
+# ============================================================
+def confianza_minima(predicciones: Any) -> float:
+    """Confianza del diente menos seguro (0 si no hay predicciones)."""
+    if not isinstance(predicciones, list) or not predicciones:
+        return 0.0
+    return min(float(p.get("confidence", 0.0)) for p in predicciones)
+
+
+def motivo_escalamiento(expected, dientes_local, predicciones_local):
+    """
+    Decide si el ciclo consulta también al procesador nube.
+    Devuelve el motivo ("siempre", "faltan_dientes", "baja_confianza", "auditoria")
+    o None si basta con el modelo local.
+    """
+    cfg = config.get("cascada", {})
+    if not cfg.get("habilitada", False):
+        return "siempre"
+
+    if dientes_local < expected:
+        return "faltan_dientes"
+
+    if confianza_minima(predicciones_local) < cfg.get("umbral_confianza", 0.5):
+        return "baja_confianza"
+
+    # El primer ciclo siempre audita: así hay una latencia de nube de referencia
+    cada_n = cfg.get("auditoria_cada_n", 0)
+    if cada_n > 0 and (estado_interno.numero_ciclo - 1) % cada_n == 0:
+        return "auditoria"
+
+    return None
+
+
+def registrar_cascada(motivo, latencia_nube_ms):
+    """Acumula tasa de escalamiento y latencia ahorrada; devuelve el resumen del ciclo."""
+    c = estado_interno.cascada
+    c["ciclos"] += 1
+
+    if motivo is not None:
+        c["escalados"] += 1
+        previa = c["latencia_nube_ms"]
+        c["latencia_nube_ms"] = latencia_nube_ms if previa is None else 0.8 * previa + 0.2 * latencia_nube_ms
+        ahorro = 0.0
+    else:
+        # Estimación: lo que habría tardado la nube según las últimas llamadas
+        ahorro = c["latencia_nube_ms"] or 0.0
+        c["latencia_ahorrada_ms"] += ahorro
+
+    return {
+        "escalado": motivo is not None,
+        "motivo": motivo,
+        "latencia_ahorrada_ciclo_ms": round(ahorro, 1),
+        "latencia_ahorrada_ms": round(c["latencia_ahorrada_ms"], 1),
+        "tasa_escalamiento": round(c["escalados"] / c["ciclos"], 3),
+        "ciclos": c["ciclos"],
+        "escalados": c["escalados"]
+    }
+
+
 # ============================================================
 # CICLO PRINCIPAL
 # ============================================================
@@ -168,27 +274,75 @@ def ejecutar_ciclo():
     # 1) SNAPSHOT DESDE EL SERVICIO CAPTURADOR
     # --------------------------------------------------------
     url_snap = servicios["servicio_capturador_imagen"] + servicios["servicio_capturador_imagen_rutas"][0]
-    snap = llamar_servicio("GET", url_snap)
 
-    imagen_b64 = snap["image"]
-    meta = snap["metadata"]
+    binario = config.get("transporte_binario", False)
+    resp = llamar_servicio(
+        "GET", url_snap,
+        headers={"Accept": "image/jpeg" if binario else "application/json"},
+        raw=True, aceptar=(422,)
+    )
+
+    if resp.status_code in (204, 422):
+        # Escena sin cambios (204) o ráfaga movida (422): no vale la pena inferir
+        motivo = "sin_cambios" if resp.status_code == 204 else "borroso"
+        logger.info(f"Snapshot descartado ({motivo}); se omite la inferencia del ciclo")
+        with state["lock"]:
+            state["last_cycle_info"] = {
+                "descartado": motivo,
+                "detalle": resp.json() if resp.content else None
+            }
+        return False
+
+    if binario:
+        # JPEG crudo de punta a punta; base64 solo una vez, para los almacenadores
+        imagen_jpeg = resp.content
+        meta = json.loads(resp.headers.get("X-Metadata") or "{}")
+        imagen_b64 = base64.b64encode(imagen_jpeg).decode("utf-8")
+        proc_kwargs = {"data": imagen_jpeg, "headers": {"Content-Type": "image/jpeg"}}
+    else:
+        snap = resp.json()
+        imagen_b64 = snap["image"]
+        meta = snap["metadata"]
+        proc_kwargs = {"json_body": {"image": imagen_b64}}
+
     expected = meta.get("expected_teeth", config["default_expected_teeth"])
 
+    # El reporte solo usa predicciones: sin imagen anotada ni raw (render bajo demanda)
+    include = config.get("procesadores_include", "predicciones")
+    query = f"?include={include}" if include else ""
+    bytes_ciclo = {"snapshot": len(resp.content)}
+
     # --------------------------------------------------------
     # 2) PROCESADOR LOCAL
     # --------------------------------------------------------
     url_local = servicios["servicio_procesador_imagen_modelo_local"] + servicios["servicio_procesador_imagen_modelo_local_rutas"][0]
 
-    proc_local = llamar_servicio("POST", url_local, json_body={"image": imagen_b64})
+    resp_local = llamar_servicio("POST", url_local + query, raw=True, **proc_kwargs)
+    proc_local = resp_local.json()
+    bytes_ciclo["proc_local"] = len(resp_local.content)
     dientes_local = contar_dientes(proc_local.get("predicciones", []))
 
     # --------------------------------------------------------
-    # 3) PROCESADOR NUBE
+    # 3) PROCESADOR NUBE (solo si la cascada escala)
     # --------------------------------------------------------
-    url_nube = servicios["servicio_procesador_imagen_modelo_nube"] + servicios["servicio_procesador_imagen_modelo_nube_rutas"][0]
+    motivo = motivo_escalamiento(expected, dientes_local, proc_local.get("predicciones", []))
+    latencia_nube_ms = None
+
+    if motivo is not None:
+        url_nube = servicios["servicio_procesador_imagen_modelo_nube"] + servicios["servicio_procesador_imagen_modelo_nube_rutas"][0]
+
+        t0 = time.perf_counter()
+        resp_nube = llamar_servicio("POST", url_nube + query, raw=True, **proc_kwargs)
+        latencia_nube_ms = (time.perf_counter() - t0) * 1000
+        proc_nube = resp_nube.json()
+        bytes_ciclo["proc_nube"] = len(resp_nube.content)
+        dientes_nube = contar_dientes(proc_nube.get("predicciones", []))
+    else:
+        logger.info(f"Cascada: local ve {dientes_local}/{expected} dientes con confianza suficiente; se omite la nube")
+        proc_nube = {"omitido": True, "motivo": "cascada"}
+        dientes_nube = None
 
-    proc_nube = llamar_servicio("POST", url_nube, json_body={"image": imagen_b64})
-    dientes_nube = contar_dientes(proc_nube.get("predicciones", []))
+    cascada = registrar_cascada(motivo, latencia_nube_ms)
 
     # --------------------------------------------------------
     # 4) Calcular indicadores y detección de incidente
@@ -196,6 +350,9 @@ def ejecutar_ciclo():
     indicadores = construir_indicadores(expected, dientes_local, dientes_nube)
     incidente = indicadores["es_incidente"]
 
+    # Lo antes posible: el ring buffer de la cámara sigue avanzando
+    clip_incidente = solicitar_clip_incidente() if incidente else None
+
     # --------------------------------------------------------
     # 5) ALMACENAMIENTO LOCAL (siempre)
     # --------------------------------------------------------
@@ -239,6 +396,9 @@ def ejecutar_ciclo():
         "ruta_imagen_local": None,
         "ruta_imagen_nube": None,
 
+        # clip pre-incidente exportado por la cámara (si está habilitado)
+        "clip_incidente": clip_incidente,
+
         # resultados de procesamiento
         "resultados_procesamiento_local": proc_local,
         "resultados_procesamiento_nube": proc_nube,
@@ -259,6 +419,9 @@ def ejecutar_ciclo():
         "indicadores_recurrencia": indicadores
     }
 
+    bytes_ciclo["reporte_local"] = len(json.dumps(payload_local))
+    bytes_ciclo["total"] = sum(bytes_ciclo.values())
+    logger.info(f"Bytes del ciclo: {bytes_ciclo}")
 
     try:
         llamar_servicio("POST", url_store_local, json_body=payload_local, timeout=10)
@@ -291,7 +454,7 @@ def ejecutar_ciclo():
     # 8) Guardar últimos datos para monitoreo SSE/GUI
     # --------------------------------------------------------
     with state["lock"]:
-        state["last_cycle_info"] = indicadores
+        state["last_cycle_info"] = {**indicadores, "bytes_ciclo": bytes_ciclo, "cascada": cascada}
         state["last_success"] = _ts()
 
     return incidente
@@ -1,13 +1,25 @@
 import os
 import sys
 import json
+import base64
+import asyncio
+import urllib.parse
 import threading
 import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import cv2
-from flask import Flask, Response, jsonify
+import numpy as np
+from flask import Flask, Response, jsonify, request, send_file
+from werkzeug.datastructures import MultiDict
 
 app = Flask(__name__)
 
+FRAME_WAIT_TIMEOUT = 1.0   # segundos máximos bloqueado esperando un frame nuevo
+
 # ============================================================
 # ESTADO GLOBAL
 # ============================================================
@@ -17,19 +29,351 @@ def _ts():
 state = {
     "service_name": "servicio_transmision_camara",
     "config": None,
-    "cap": None,
     "running": False,
     "paused": False,
     "uptime_start": None,
-    "frame": None,
-    "last_error": None,
-    "last_success": None,
-    "lock": threading.Lock(),
-    "current_cam_index": 0,
-    "camera_list": [0, 1, 2, 3]
+    "workers": OrderedDict(),
+    "clips": {},
+    "async_server": None,
+    "lock": threading.Lock()
 }
 
 
+# ============================================================
+# BUS DE FRAMES
+# ============================================================
+class FramePacket:
+    """
+    Frame publicado. Inmutable una vez creado: se comparte entre clientes.
+    En modo passthrough solo trae el JPEG de la cámara; los píxeles se
+    decodifican recién cuando algún consumidor accede a .frame.
+    """
+    __slots__ = ("frame_id", "_frame", "jpeg", "part", "captured_at", "score", "changed",
+                 "token", "_decode_lock")
+
+    def __init__(self, frame_id, frame, jpeg, part, captured_at, score=None, changed=True, token=None):
+        self.frame_id = frame_id
+        self._frame = frame
+        self.jpeg = jpeg
+        self.part = part
+        self.captured_at = captured_at
+        self.score = score
+        self.changed = changed
+        self.token = token   # (slot, generación) en el FramePool, o None
+        self._decode_lock = threading.Lock() if frame is None else None
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            with self._decode_lock:
+                if self._frame is None:
+                    frame = cv2.imdecode(np.frombuffer(self.jpeg, np.uint8), cv2.IMREAD_COLOR)
+                    frame.flags.writeable = False
+                    self._frame = frame
+        return self._frame
+
+    @property
+    def width(self):
+        """Ancho sin decodificar (cabecera SOF del JPEG) si aún no hay píxeles."""
+        if self._frame is None:
+            size = jpeg_dimensions(self.jpeg)
+            if size:
+                return size[0]
+        return self.frame.shape[1]
+
+
+def jpeg_dimensions(jpeg):
+    """(ancho, alto) leyendo el marcador SOF del JPEG, sin decodificar. None si no se encuentra."""
+    i, n = 2, len(jpeg)
+    while i + 9 < n:
+        if jpeg[i] != 0xFF:
+            i += 1
+            continue
+
+        marker = jpeg[i + 1]
+        if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 1 if marker == 0xFF else 2
+            continue
+
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(jpeg[i + 5:i + 7], "big")
+            width = int.from_bytes(jpeg[i + 7:i + 9], "big")
+            return width, height
+
+        i += 2 + int.from_bytes(jpeg[i + 2:i + 4], "big")
+
+    return None
+
+
+class FrameBus:
+    """
+    Publicación de frames por eventos (Condition) con IDs monotónicos.
+    Los consumidores bloquean hasta que llega un frame nuevo y nunca
+    reciben dos veces el mismo.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._latest = None
+        self._last_changed = None
+        self._last_id = 0
+
+    def publish(self, frame, jpeg, part, score=None, changed=True, token=None):
+        with self._cond:
+            self._last_id += 1
+            packet = FramePacket(self._last_id, frame, jpeg, part, time.time(), score, changed, token)
+            self._latest = packet
+            if changed:
+                self._last_changed = packet
+            self._cond.notify_all()
+        return packet
+
+    def latest(self):
+        with self._cond:
+            return self._latest
+
+    def wait_next(self, last_id, timeout=None, changed_only=False):
+        """
+        Devuelve el frame más reciente con id > last_id, o None si vence el timeout.
+        changed_only=True: solo frames marcados como "changed" por el detector.
+        """
+        def candidate():
+            return self._last_changed if changed_only else self._latest
+
+        with self._cond:
+            ok = self._cond.wait_for(
+                lambda: candidate() is not None and candidate().frame_id > last_id,
+                timeout
+            )
+            return candidate() if ok else None
+
+
+# ============================================================
+# BUFFERS DE FRAME PREASIGNADOS (zero-copy)
+# ============================================================
+class FramePool:
+    """
+    Triple buffering (por defecto): cap.read() escribe directo en buffers
+    preasignados y el frame se publica POR REFERENCIA como vista de solo
+    lectura. No hay memcpy por frame ni por cliente.
+
+    Cada slot tiene un lock y una generación: un lector que necesita los
+    píxeles (p.ej. una variante) toma el lock con reading(token) y verifica que
+    la captura no haya reutilizado el slot desde que se publicó.
+    """
+
+    def __init__(self, size=3):
+        self.size = max(2, size)
+        self._buffers = [None] * self.size
+        self._locks = [threading.Lock() for _ in range(self.size)]
+        self._generations = [0] * self.size
+        self._next = 0
+        self.reallocs = 0
+
+    def acquire(self):
+        """Reserva el siguiente slot para escribir. Devuelve (slot, buffer o None)."""
+        slot = self._next
+        self._next = (slot + 1) % self.size
+        self._locks[slot].acquire()
+        self._generations[slot] += 1
+        return slot, self._buffers[slot]
+
+    def commit(self, slot, frame):
+        """Libera el slot escrito y devuelve (vista de solo lectura, token)."""
+        if frame is not self._buffers[slot]:
+            # Primer frame o cambio de resolución: cap.read() asignó un array nuevo
+            self._buffers[slot] = frame
+            self.reallocs += 1
+        token = (slot, self._generations[slot])
+        self._locks[slot].release()
+
+        view = frame.view()
+        view.flags.writeable = False
+        return view, token
+
+    def abort(self, slot):
+        self._locks[slot].release()
+
+    @contextmanager
+    def reading(self, token):
+        """Bloquea el slot mientras se leen píxeles; entrega False si ya fue reutilizado."""
+        if token is None:
+            yield True
+            return
+
+        slot, generation = token
+        with self._locks[slot]:
+            yield self._generations[slot] == generation
+
+
+# ============================================================
+# DETECCIÓN DE CAMBIOS (gating de movimiento)
+# ============================================================
+class ChangeDetector:
+    """
+    Diferencia absoluta media sobre una versión gris muy reducida del frame
+    (p.ej. 64 px de ancho): cuesta microsegundos frente a un encode completo.
+    La referencia es el último frame "changed", así la deriva lenta también
+    termina marcándose.
+    """
+
+    def __init__(self, width=64, threshold=4.0):
+        self.width = width
+        self.threshold = threshold
+        self._ref = None
+
+    def update(self, frame):
+        """Devuelve (score, changed). score en niveles de gris (0-255)."""
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, self.width * h // w)),
+                           interpolation=cv2.INTER_AREA)
+        return self._compare(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+
+    def update_jpeg(self, jpeg):
+        """Igual que update(), decodificando el JPEG directo en gris a 1/8 (barato)."""
+        gray = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None:
+            return None, True
+        h, w = gray.shape[:2]
+        return self._compare(cv2.resize(gray, (self.width, max(1, self.width * h // w)),
+                                        interpolation=cv2.INTER_AREA))
+
+    def _compare(self, gray):
+        gray = gray.astype(np.int16)
+
+        if self._ref is None or self._ref.shape != gray.shape:
+            self._ref = gray
+            return None, True
+
+        score = float(np.abs(gray - self._ref).mean())
+        changed = score >= self.threshold
+        if changed:
+            self._ref = gray
+        return round(score, 3), changed
+
+
+# ============================================================
+# VARIANTES POR PERFIL (calidad / resolución)
+# ============================================================
+class VariantCache:
+    """
+    Cache de variantes codificadas del último frame, una por (ancho_max, calidad).
+    N clientes con el mismo perfil cuestan UNA codificación, no N.
+    """
+
+    def __init__(self, max_variants=8, pool=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_variants = max_variants
+        self.pool = pool
+        self.encodes = 0
+        self.stale = 0
+
+    def get(self, packet, max_width=None, quality=None):
+        """
+        Devuelve (frame_id, part) de la variante pedida para el packet.
+        part es None si el buffer del packet ya fue reutilizado y no hay variante previa.
+        """
+        entry = self._entry(packet, max_width, quality)
+        return entry["frame_id"], entry["part"]
+
+    def get_jpeg(self, packet, max_width=None, quality=None):
+        """Devuelve (frame_id, jpeg) de la variante pedida para el packet."""
+        entry = self._entry(packet, max_width, quality)
+        return entry["frame_id"], entry["jpeg"]
+
+    def _entry(self, packet, max_width, quality):
+        width = packet.width
+        if (max_width is None or max_width >= width) and quality is None:
+            return {"frame_id": packet.frame_id, "jpeg": packet.jpeg, "part": packet.part}
+
+        key = (max_width if max_width and max_width < width else None, quality)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"lock": threading.Lock(), "frame_id": 0, "jpeg": None, "part": None}
+                self._entries[key] = entry
+                while len(self._entries) > self.max_variants:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+
+        with entry["lock"]:
+            # Un cliente lento nunca fuerza a re-codificar un frame más viejo
+            if entry["frame_id"] < packet.frame_id:
+                reading = self.pool.reading(packet.token) if self.pool else nullcontext(True)
+                with reading as valid:
+                    jpeg = encode_variant(packet.frame, key[0], quality) if valid else None
+
+                if jpeg is None:
+                    with self._lock:
+                        self.stale += 1
+                    return dict(entry)
+
+                entry["jpeg"] = jpeg
+                entry["part"] = build_part(jpeg)
+                entry["frame_id"] = packet.frame_id
+                with self._lock:
+                    self.encodes += 1
+            return dict(entry)
+
+    def stats(self):
+        with self._lock:
+            return {"variants": [list(k) for k in self._entries], "encodes": self.encodes,
+                    "stale_skips": self.stale}
+
+
+# ============================================================
+# RING BUFFER PRE-INCIDENTE
+# ============================================================
+class FrameRing:
+    """
+    Últimos N segundos de frames YA codificados (bytes JPEG, no ndarrays),
+    con tope duro de memoria. push() es O(1) amortizado: no frena camera_loop.
+    """
+
+    def __init__(self, max_seconds=15, max_bytes=64 * 1024 * 1024):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = deque()
+        self._bytes = 0
+        self.dropped = 0
+
+    def push(self, packet):
+        size = len(packet.jpeg)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._items.append((packet.captured_at, packet.frame_id, packet.jpeg))
+            self._bytes += size
+
+            limit = packet.captured_at - self.max_seconds
+            while self._items and (self._bytes > self.max_bytes or self._items[0][0] < limit):
+                _, _, old = self._items.popleft()
+                self._bytes -= len(old)
+                self.dropped += 1
+
+    def window(self, start, end):
+        """Lista [(captured_at, frame_id, jpeg)] dentro de [start, end]. Solo copia referencias."""
+        with self._lock:
+            return [item for item in self._items if start <= item[0] <= end]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_seconds": self.max_seconds,
+                "oldest": self._items[0][0] if self._items else None,
+                "newest": self._items[-1][0] if self._items else None,
+                "dropped": self.dropped
+            }
+
+
 # ============================================================
 # CONFIG
 # ============================================================
@@ -45,12 +389,188 @@ def load_config():
         return json.load(f)
 
 
+# ============================================================
+# FUENTES DE VIDEO
+# ============================================================
+# Cada "device" de config.json puede ser:
+#   0, 1, ...                         → cámara USB (cv2.VideoCapture)
+#   "file:videos/pala.mp4"            → archivo de video (en loop)
+#   "dir:capturas/"                   → directorio de JPEG/PNG (en loop)
+#   "synthetic:1280x720@30"           → patrón sintético generado
+# Opciones tras "?": fps=<n> (archivo/directorio), loop=0, fail_after=<n frames>
+# (simula la caída de la fuente para medir failover).
+# Todas exponen la misma interfaz que cv2.VideoCapture: isOpened/read/grab/release.
+
+class PacedSource:
+    """Base para fuentes no físicas: ritmo a FPS fijo e inyección de fallas."""
+
+    def __init__(self, fps=30.0, fail_after=None):
+        self.fps = fps
+        self.fail_after = fail_after
+        self.frames = 0
+        self._next_due = time.monotonic()
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+
+    def grab(self):
+        ret, _ = self.read()
+        return ret
+
+    def read(self, image=None):
+        if not self._opened or (self.fail_after is not None and self.frames >= self.fail_after):
+            return False, None
+
+        # Simula el bloqueo de cap.read() al ritmo de la cámara
+        if self.fps:
+            delay = self._next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_due = max(self._next_due, time.monotonic() - 1.0) + 1.0 / self.fps
+
+        frame = self.next_frame()
+        if frame is None:
+            return False, None
+
+        self.frames += 1
+        # Igual que cv2.VideoCapture.read(image): escribir en el buffer del llamador
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def next_frame(self):
+        raise NotImplementedError
+
+
+class SyntheticSource(PacedSource):
+    """Patrón en movimiento a resolución/FPS configurables (sin hardware)."""
+
+    def __init__(self, width=1280, height=720, fps=30.0, fail_after=None):
+        super().__init__(fps, fail_after)
+        xs = np.linspace(0, 255, width, dtype=np.uint8)
+        ys = np.linspace(0, 255, height, dtype=np.uint8)
+        self._base = np.dstack([
+            np.tile(xs, (height, 1)),
+            np.tile(ys[:, None], (1, width)),
+            np.full((height, width), 96, np.uint8)
+        ])
+
+    def next_frame(self):
+        h, w = self._base.shape[:2]
+        frame = np.roll(self._base, (self.frames * 4) % w, axis=1)
+        x = (self.frames * 7) % max(1, w - h // 4)
+        cv2.rectangle(frame, (x, h // 3), (x + h // 4, h // 3 + h // 4), (255, 255, 255), -1)
+        cv2.putText(frame, f"#{self.frames}", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+        return frame
+
+
+class ImageDirSource(PacedSource):
+    """Recorre en loop las imágenes de un directorio (orden alfabético)."""
+
+    EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, path, fps=10.0, loop=True, fail_after=None):
+        super().__init__(fps, fail_after)
+        self.loop = loop
+        self.files = sorted(
+            os.path.join(path, f) for f in os.listdir(path)
+            if f.lower().endswith(self.EXTENSIONS)
+        )
+        self._opened = bool(self.files)
+
+    def next_frame(self):
+        if self.frames >= len(self.files) and not self.loop:
+            return None
+        return cv2.imread(self.files[self.frames % len(self.files)], cv2.IMREAD_COLOR)
+
+
+class VideoFileSource(PacedSource):
+    """Archivo de video en loop, al FPS del archivo (o el indicado)."""
+
+    def __init__(self, path, fps=None, loop=True, fail_after=None):
+        self._cap = cv2.VideoCapture(path)
+        super().__init__(fps or self._cap.get(cv2.CAP_PROP_FPS) or 30.0, fail_after)
+        self.loop = loop
+        self._opened = self._cap.isOpened()
+
+    def next_frame(self):
+        ret, frame = self._cap.read()
+        if not ret and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        return frame if ret else None
+
+    def release(self):
+        super().release()
+        self._cap.release()
+
+
+def parse_source(spec):
+    """"tipo:valor?k=v&..." → (tipo, valor, opciones). Enteros = cámara USB."""
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return "device", int(spec), {}
+
+    kind, _, rest = str(spec).partition(":")
+    value, _, query = rest.partition("?")
+    options = dict(pair.partition("=")[::2] for pair in query.split("&") if pair)
+    return kind, value, options
+
+
+def open_source(spec):
+    kind, value, opts = parse_source(spec)
+    fail_after = int(opts["fail_after"]) if "fail_after" in opts else None
+    loop = opts.get("loop", "1") not in ("0", "false")
+
+    if kind == "device":
+        return cv2.VideoCapture(value)
+
+    if kind == "synthetic":
+        size, _, fps = value.partition("@")
+        width, _, height = (size or "1280x720").partition("x")
+        return SyntheticSource(int(width), int(height), float(fps or 30), fail_after)
+
+    if kind == "dir":
+        return ImageDirSource(value, float(opts.get("fps", 10)), loop, fail_after)
+
+    if kind == "file":
+        fps = float(opts["fps"]) if "fps" in opts else None
+        return VideoFileSource(value, fps, loop, fail_after)
+
+    raise ValueError(f"Fuente de video desconocida: {spec}")
+
+
+def enable_mjpeg_passthrough(cap):
+    """
+    Pide MJPG a la cámara y desactiva la conversión a BGR: read() entrega
+    el JPEG de la cámara tal cual (buffer 1-D). Solo cámaras físicas.
+    """
+    if not isinstance(cap, cv2.VideoCapture):
+        return False
+
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+    return bool(cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+
+
+def disable_mjpeg_passthrough(cap):
+    cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+
+
+def is_jpeg_buffer(frame):
+    return frame is not None and frame.ndim <= 2 and min(frame.shape) == 1 and \
+        frame.size > 4 and frame.flat[0] == 0xFF and frame.flat[1] == 0xD8
+
+
 # ============================================================
 # GESTIÓN CÁMARAS ROBUSTA
 # ============================================================
 def try_open_camera(cam_id):
     try:
-        cap = cv2.VideoCapture(cam_id)
+        cap = open_source(cam_id)
         if not cap.isOpened():
             return None
         return cap
@@ -58,66 +578,383 @@ def try_open_camera(cam_id):
         return None
 
 
-def rotate_to_next_camera():
-    state["current_cam_index"] = (state["current_cam_index"] + 1) % len(state["camera_list"])
-    return state["camera_list"][state["current_cam_index"]]
+def discover_cameras(cam_ids):
+    """Prueba todas las cámaras EN PARALELO. Devuelve [(cam_id, cap)] en el orden de cam_ids."""
+    if not cam_ids:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(cam_ids)) as pool:
+        caps = list(pool.map(try_open_camera, cam_ids))
+
+    return [(cam_id, cap) for cam_id, cap in zip(cam_ids, caps) if cap is not None]
 
 
-def recover_camera_infinite():
+def release_cameras(found):
+    for _, cap in found:
+        try:
+            cap.release()
+        except Exception:
+            pass
+
+
+# ============================================================
+# WORKER POR CÁMARA
+# ============================================================
+class CameraWorker:
     """
-    NO FALLA NUNCA.
-    Intenta en bucle infinito encontrar alguna cámara disponible.
+    Captura de UNA cámara lógica (p.ej. balde izquierdo) en su propio hilo,
+    con su propio bus de frames, ring buffer, variantes y estadísticas.
+    Una cámara lenta no frena a las demás.
+
+    `devices` son los IDs físicos candidatos: el primero disponible queda
+    activo y el siguiente en standby.
     """
-    while True:
-        cam_id = state["camera_list"][state["current_cam_index"]]
-        cap = try_open_camera(cam_id)
 
-        if cap:
-            state["cap"] = cap
-            state["last_error"] = None
-            print(f"[RECOVER] Cámara detectada en ID {cam_id}")
-            return
+    def __init__(self, cam_id, devices, cfg):
+        self.cam_id = str(cam_id)
+        self.devices = list(devices)
+        self.standby_enabled = cfg.get("standby_enabled", True)
+        self.passthrough = cfg.get("mjpeg_passthrough", False)
+        self.passthrough_active = False
+        self.standby_interval = cfg.get("standby_check_interval_sec", 1.0)
+        self.standby_max_backoff = cfg.get("standby_max_backoff_sec", 60.0)
 
-        # No hay cámara → rotar
-        state["last_error"] = f"No hay cámara disponible (intentando ID {cam_id})"
-        print(f"[WAIT] No se pudo abrir la cámara {cam_id}, rotando...")
+        self.bus = FrameBus()
+        self.pool = FramePool(cfg.get("frame_buffers", 3))
+        self.variants = VariantCache(cfg.get("max_stream_variants", 8), self.pool)
 
-        rotate_to_next_camera()
-        time.sleep(1)   # evitar loops agresivos
+        ring_cfg = cfg.get("ring_buffer", {})
+        self.ring = FrameRing(
+            max_seconds=ring_cfg.get("seconds", 15),
+            max_bytes=int(ring_cfg.get("max_mb", 64) * 1024 * 1024)
+        )
 
+        self.lock = threading.Lock()
+        self.cam_lock = threading.Lock()
+        self.discovery_lock = threading.Lock()   # un solo descubrimiento a la vez por worker
+        self.recovering = False
+        self.running = False
+        self.cap = None
+        self.active_id = None
+        self.standby_id = None
+        self.standby_cap = None
+        self.last_error = None
+        self.last_success = None
+        self.frames = 0
+        self.frame_interval = None   # EMA del intervalo entre frames (s)
 
-# ============================================================
-# LOOP CÁMARA
-# ============================================================
-def camera_loop():
-    while state["running"]:
-        cap = state["cap"]
+        motion_cfg = cfg.get("motion", {})
+        self.detector = ChangeDetector(
+            width=motion_cfg.get("width", 64),
+            threshold=motion_cfg.get("threshold", 4.0)
+        ) if motion_cfg.get("enabled", False) else None
+        self.skip_unchanged = motion_cfg.get("skip_unchanged", False)
+        self.max_idle_sec = motion_cfg.get("max_idle_sec", 1.0)
+        self.last_score = None
+        self.changed_frames = 0
+        self.skipped_frames = 0
+        self._last_published = 0.0
+        self.failover = {
+            "count": 0,
+            "last_latency_ms": None,
+            "last_frames_lost": 0,
+            "total_frames_lost": 0,
+            "last_at": None
+        }
 
-        if cap is None:
-            recover_camera_infinite()
-            continue
+    def log(self, tag, msg):
+        print(f"[{tag}][{self.cam_id}] {msg}")
 
-        ret, frame = cap.read()
+    # --------------------------------------------------------
+    # Gestión de dispositivos
+    # --------------------------------------------------------
+    def set_active(self, dev_id, cap):
+        self.passthrough_active = self.passthrough and enable_mjpeg_passthrough(cap)
+        if self.passthrough_active:
+            self.log("PASSTHROUGH", f"Cámara {dev_id} entregando MJPEG nativo")
 
-        if not ret:
-            print("[ERROR] Frame inválido → recuperando cámara…")
-            state["cap"] = None
-            continue
+        self.cap = cap
+        self.active_id = dev_id
+        self.last_error = None
 
-        with state["lock"]:
-            state["frame"] = frame.copy()
-            state["last_success"] = _ts()
+    def offer_standby(self, dev_id, cap):
+        """Deja la cámara como standby si el puesto está libre; si no, la libera."""
+        with self.cam_lock:
+            if self.standby_cap is None and dev_id != self.active_id:
+                self.standby_id = dev_id
+                self.standby_cap = cap
+                return True
+
+        release_cameras([(dev_id, cap)])
+        return False
+
+    def take_standby(self):
+        with self.cam_lock:
+            dev_id, cap = self.standby_id, self.standby_cap
+            self.standby_id = self.standby_cap = None
+        return dev_id, cap
+
+    def recover(self):
+        """
+        NO FALLA NUNCA.
+        1) Failover inmediato a la cámara standby (ya abierta).
+        2) Si no hay standby, descubrimiento paralelo de todos los devices.
+        """
+        self.recovering = True
+        try:
+            self._recover()
+        finally:
+            self.recovering = False
+
+    def _recover(self):
+        while self.running:
+            standby_id, standby = self.take_standby()
+
+            if standby is not None:
+                self.set_active(standby_id, standby)
+                self.log("FAILOVER", f"Cambio inmediato a cámara standby ID {standby_id}")
+                return
+
+            with self.discovery_lock:
+                found = discover_cameras(self.devices)
+
+            if found:
+                dev_id, cap = found[0]
+                self.set_active(dev_id, cap)
+                self.log("RECOVER", f"Cámara detectada en ID {dev_id}")
+
+                if len(found) > 1 and self.standby_enabled:
+                    self.offer_standby(*found[1])
+                    found = found[1:]
+                release_cameras(found[1:])
+                return
+
+            self.last_error = f"No hay cámara disponible (probadas: {self.devices})"
+            self.log("WAIT", f"Ninguna cámara disponible en {self.devices}, reintentando...")
+
+            time.sleep(1)   # evitar loops agresivos
+
+    def standby_loop(self):
+        """
+        Mantiene una cámara secundaria abierta (hot standby):
+        grab() periódico para verificar que sigue viva y mantener su buffer fresco.
+        Si no hay standby, busca una en paralelo entre los devices no activos,
+        con backoff exponencial mientras no aparezca ninguna.
+        """
+        backoff = self.standby_interval
+        next_probe = 0.0
+
+        while self.running:
+            time.sleep(self.standby_interval)
+
+            if self.cap is None or self.recovering:
+                continue   # recover() está a cargo
+
+            dev_id, cap = self.take_standby()
+
+            if cap is not None:
+                if cap.grab():
+                    self.offer_standby(dev_id, cap)
+                else:
+                    self.log("STANDBY", f"Cámara standby {dev_id} dejó de responder")
+                    release_cameras([(dev_id, cap)])
+                continue
+
+            if time.monotonic() < next_probe:
+                continue
+
+            if not self.discovery_lock.acquire(blocking=False):
+                continue   # recover() está probando los mismos devices
+            try:
+                candidates = [d for d in self.devices if d != self.active_id]
+                found = discover_cameras(candidates)
+            finally:
+                self.discovery_lock.release()
+
+            if found:
+                backoff = self.standby_interval
+                if self.offer_standby(*found[0]):
+                    self.log("STANDBY", f"Cámara {found[0][0]} en espera activa")
+                release_cameras(found[1:])
+            else:
+                backoff = min(backoff * 2, self.standby_max_backoff)
+            next_probe = time.monotonic() + backoff
+
+    def record_failover(self, blind_sec):
+        """Latencia de failover = tiempo sin frames; frames perdidos según el intervalo medido."""
+        interval = self.frame_interval
+        lost = max(0, round(blind_sec / interval) - 1) if interval else 0
 
-        time.sleep(0.03)
+        with self.lock:
+            fo = self.failover
+            fo["count"] += 1
+            fo["last_latency_ms"] = round(blind_sec * 1000, 1)
+            fo["last_frames_lost"] = lost
+            fo["total_frames_lost"] += lost
+            fo["last_at"] = _ts()
+
+    # --------------------------------------------------------
+    # Loop de captura
+    # --------------------------------------------------------
+    def capture_loop(self):
+        last_frame_at = None
+        outage_since = None
+
+        while self.running:
+            cap = self.cap
+
+            if cap is None:
+                self.recover()
+                continue
+
+            if self.passthrough_active:
+                # JPEG nativo de la cámara: tamaño variable, sin pool de buffers
+                slot, buffer = None, None
+                try:
+                    ret, frame = cap.read()
+                except Exception:
+                    ret, frame = False, None
+            else:
+                # Lectura directa al buffer preasignado: sin frame.copy()
+                slot, buffer = self.pool.acquire()
+                try:
+                    ret, frame = cap.read(buffer) if buffer is not None else cap.read()
+                except Exception:
+                    ret, frame = False, None
+            now = time.monotonic()
+
+            if not ret:
+                if slot is not None:
+                    self.pool.abort(slot)
+                self.log("ERROR", "Frame inválido → recuperando cámara…")
+                release_cameras([(self.active_id, cap)])
+                self.cap = None
+                if outage_since is None:
+                    outage_since = last_frame_at or now
+                continue
+
+            if outage_since is not None:
+                self.record_failover(now - outage_since)
+                outage_since = None
+            elif last_frame_at is not None:
+                dt = now - last_frame_at
+                self.frame_interval = dt if self.frame_interval is None else 0.9 * self.frame_interval + 0.1 * dt
+
+            last_frame_at = now
+
+            # cap.read() ya bloquea al ritmo de la cámara: sin sleep fijo
+            if slot is None:
+                if is_jpeg_buffer(frame):
+                    self.publish(jpeg=frame.tobytes())
+                else:
+                    # El backend no respetó MJPG/CONVERT_RGB=0: volver al modo BGR
+                    self.log("PASSTHROUGH", "La cámara no entrega MJPEG, se usa decodificación normal")
+                    disable_mjpeg_passthrough(cap)
+                    self.passthrough_active = False
+                continue
+
+            frame, token = self.pool.commit(slot, frame)
+            self.publish(frame, token)
+
+    def publish(self, frame=None, token=None, jpeg=None):
+        """
+        Codifica el frame UNA sola vez y lo publica en el bus.
+        Todos los clientes de /video_feed comparten el mismo buffer (bytes inmutables),
+        sin copia ni re-codificación por cliente.
+        Con skip_unchanged, los frames sin cambios no se codifican ni publican
+        (salvo uno cada max_idle_sec, para que /snapshot no quede viejo).
+        En passthrough llega `jpeg` (sin frame) y no se decodifica ni re-codifica.
+        """
+        if self.detector is None:
+            score, changed = None, True
+        elif jpeg is not None:
+            score, changed = self.detector.update_jpeg(jpeg)
+        else:
+            score, changed = self.detector.update(frame)
+        now = time.monotonic()
+
+        with self.lock:
+            self.frames += 1
+            self.last_score = score
+            self.last_success = _ts()
+            if changed:
+                self.changed_frames += 1
+            elif self.skip_unchanged and now - self._last_published < self.max_idle_sec:
+                self.skipped_frames += 1
+                return
+
+        if jpeg is None:
+            jpeg = encode_frame(frame)
+        packet = self.bus.publish(frame, jpeg, build_part(jpeg), score, changed, token)
+        self.ring.push(packet)
+        self._last_published = now
+
+    def start(self):
+        self.running = True
+        self.log("INIT", f"Iniciando búsqueda de cámara en {self.devices}...")
+        threading.Thread(target=self.capture_loop, name=f"cam-{self.cam_id}", daemon=True).start()
+
+        if self.standby_enabled:
+            threading.Thread(target=self.standby_loop, name=f"standby-{self.cam_id}", daemon=True).start()
+
+    def stats(self):
+        packet = self.bus.latest()
+        with self.lock:
+            return {
+                "camera": self.cam_id,
+                "devices": self.devices,
+                "current_device": self.active_id,
+                "standby_device": self.standby_id,
+                "last_error": self.last_error,
+                "last_success": self.last_success,
+                "has_frame": packet is not None,
+                "frame_id": packet.frame_id if packet else 0,
+                "frames": self.frames,
+                "fps": round(1.0 / self.frame_interval, 2) if self.frame_interval else None,
+                "frame_buffers": {"size": self.pool.size, "reallocs": self.pool.reallocs},
+                "mjpeg_passthrough": {"enabled": self.passthrough, "active": self.passthrough_active},
+                "stream_variants": self.variants.stats(),
+                "ring_buffer": self.ring.stats(),
+                "motion": {
+                    "enabled": self.detector is not None,
+                    "threshold": self.detector.threshold if self.detector else None,
+                    "last_score": self.last_score,
+                    "changed_frames": self.changed_frames,
+                    "skipped_frames": self.skipped_frames
+                },
+                "failover": dict(self.failover)
+            }
+
+
+def build_workers(cfg):
+    """
+    "cameras": [{"id": "izquierda", "devices": [0, 2]}, ...] en config.json.
+    Sin "cameras" se usa una sola cámara con camera_id y los IDs 0-3 de respaldo.
+    """
+    cameras = cfg.get("cameras")
+    if not cameras:
+        first = cfg.get("camera_id", 0)
+        cameras = [{"id": "principal", "devices": [first] + [d for d in (0, 1, 2, 3) if d != first]}]
+
+    workers = OrderedDict()
+    for cam in cameras:
+        worker = CameraWorker(cam["id"], cam.get("devices", [0]), cfg)
+        workers[worker.cam_id] = worker
+    return workers
 
 
 def start_camera():
-    print("[INIT] Iniciando búsqueda de cámara...")
-    state["cap"] = None
     state["running"] = True
     state["uptime_start"] = _ts()
 
-    threading.Thread(target=camera_loop, daemon=True).start()
+    for worker in state["workers"].values():
+        worker.start()
+
+
+def get_worker(cam_id=None):
+    if cam_id is None:
+        return next(iter(state["workers"].values()), None)
+    return state["workers"].get(cam_id)
 
 
 # ============================================================
@@ -128,40 +965,604 @@ def encode_frame(frame):
     return buffer.tobytes()
 
 
-def frame_generator():
-    while True:
-        with state["lock"]:
-            frame = state["frame"].copy() if state["frame"] is not None else None
+def encode_variant(frame, max_width=None, quality=None):
+    if max_width:
+        h, w = frame.shape[:2]
+        frame = cv2.resize(frame, (max_width, max(1, round(h * max_width / w))),
+                           interpolation=cv2.INTER_AREA)
 
-        if frame is None:
-            time.sleep(0.1)
+    params = [] if quality is None else [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    _, buffer = cv2.imencode(".jpg", frame, params)
+    return buffer.tobytes()
+
+
+def build_part(jpeg):
+    # Content-Length permite al lector entregar el frame apenas llega,
+    # sin esperar al boundary del siguiente
+    return (b"--frame\r\nContent-Type: image/jpeg\r\n" +
+            f"Content-Length: {len(jpeg)}\r\n\r\n".encode() +
+            jpeg +
+            b"\r\n")
+
+
+def resolve_profile(args):
+    """
+    Perfil de streaming: ?profile=<nombre> desde config.json ("stream_profiles"),
+    sobreescribible con ?fps=, ?width= y ?quality=.
+    """
+    profiles = state["config"].get("stream_profiles", {})
+    name = args.get("profile")
+
+    if name and name not in profiles:
+        raise ValueError(f"Perfil desconocido: {name}")
+
+    base = profiles.get(name, {}) if name else {}
+
+    def pick(arg, key, cast):
+        # `is None` y no `or`: fps=0 / width=0 / quality=0 deben llegar a la validación
+        value = args.get(arg, type=cast)
+        return base.get(key) if value is None else value
+
+    profile = {
+        "fps": pick("fps", "fps", float),
+        "max_width": pick("width", "max_width", int),
+        "quality": pick("quality", "quality", int)
+    }
+
+    if profile["fps"] is not None and profile["fps"] <= 0:
+        raise ValueError("fps debe ser mayor a 0")
+    if profile["max_width"] is not None and profile["max_width"] < 16:
+        raise ValueError("width debe ser al menos 16")
+    if profile["quality"] is not None and not 1 <= profile["quality"] <= 100:
+        raise ValueError("quality debe estar entre 1 y 100")
+
+    return profile
+
+
+def frame_generator(worker, profile, changed_only=False):
+    """
+    Entrega cada frame nuevo exactamente una vez; bloquea mientras no haya otro.
+    Termina (a más tardar en FRAME_WAIT_TIMEOUT) cuando el worker se detiene.
+    """
+    min_interval = 1.0 / profile["fps"] if profile["fps"] else 0.0
+    next_due = 0.0
+    last_id = 0
+
+    while worker.running:
+        # Tope de FPS: se espera y luego se toma el frame MÁS reciente (se saltan intermedios)
+        delay = next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        packet = worker.bus.wait_next(last_id, timeout=FRAME_WAIT_TIMEOUT, changed_only=changed_only)
+
+        if packet is None:
             continue
 
-        yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" +
-               encode_frame(frame) +
-               b"\r\n")
+        frame_id, part = worker.variants.get(packet, profile["max_width"], profile["quality"])
+        if part is None or frame_id <= last_id:
+            # Buffer ya reutilizado: se espera el siguiente frame (sin re-leer este packet)
+            last_id = max(last_id, packet.frame_id)
+            continue
+
+        last_id = frame_id
+        next_due = time.monotonic() + min_interval
+        yield part
+
+
+# ============================================================
+# EXPORTACIÓN DE CLIPS (hilo de fondo)
+# ============================================================
+MAX_CLIP_JOBS = 20
+
+
+def clips_dir():
+    path = state["config"].get("clips_dir", "clips")
+    if not os.path.isabs(path):
+        base = os.path.dirname(sys.executable if getattr(sys, 'frozen', False)
+                               else os.path.abspath(__file__))
+        path = os.path.join(base, path)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_clip_mjpeg(path, frames):
+    """Multipart MJPEG: los JPEG del ring se escriben tal cual, sin decodificar."""
+    with open(path, "wb") as f:
+        for captured_at, frame_id, jpeg in frames:
+            f.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+            f.write(f"Content-Length: {len(jpeg)}\r\nX-Frame-Id: {frame_id}\r\n"
+                    f"X-Timestamp: {captured_at:.6f}\r\n\r\n".encode())
+            f.write(jpeg)
+            f.write(b"\r\n")
+
+
+def write_clip_avi(path, frames):
+    """AVI MJPG: requiere decodificar cada frame, por eso corre fuera de camera_loop."""
+    duration = frames[-1][0] - frames[0][0]
+    fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+
+    writer = None
+    try:
+        for _, _, jpeg in frames:
+            img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            if writer is None:
+                h, w = img.shape[:2]
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (w, h))
+            writer.write(img)
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def remove_clip_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def export_clip_job(job, frames):
+    path = os.path.join(clips_dir(), f"{job['camera']}_{job['clip_id']}.{job['format']}")
+    try:
+        if job["format"] == "avi":
+            write_clip_avi(path, frames)
+        else:
+            write_clip_mjpeg(path, frames)
+
+        with state["lock"]:
+            job.update(status="done", path=path, size_bytes=os.path.getsize(path), finished=_ts())
+            evicted = job.get("evicted", False)
+    except Exception as e:
+        with state["lock"]:
+            job.update(status="error", error=str(e), finished=_ts())
+            evicted = job.get("evicted", False)
+
+    # Olvidado del registro mientras se escribía: nadie podrá descargarlo
+    if evicted:
+        remove_clip_file(path)
+
+
+def request_clip(worker, start, end, fmt):
+    frames = worker.ring.window(start, end)
+    if not frames:
+        return None
+
+    job = {
+        "clip_id": uuid.uuid4().hex[:12],
+        "camera": worker.cam_id,
+        "status": "pending",
+        "format": fmt,
+        "start": frames[0][0],
+        "end": frames[-1][0],
+        "frames": len(frames),
+        "created": _ts()
+    }
+
+    with state["lock"]:
+        state["clips"][job["clip_id"]] = job
+        # Registro acotado: se olvidan los trabajos más viejos y se borra su archivo
+        # (sin registro ya no se pueden descargar; clips_dir no crece sin límite)
+        evicted = [state["clips"].pop(old) for old in list(state["clips"])[:-MAX_CLIP_JOBS]]
+        for old_job in evicted:
+            old_job["evicted"] = True
+
+    for old_job in evicted:
+        if old_job.get("path"):
+            remove_clip_file(old_job["path"])
+
+    threading.Thread(target=export_clip_job, args=(job, frames), daemon=True).start()
+    return job
+
+
+# ============================================================
+# SERVIDOR ASYNCIO DE STREAMING (muchos visores)
+# ============================================================
+MJPEG_RESPONSE_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+
+class AsyncStreamServer:
+    """
+    Front-end asyncio para /video_feed: un solo hilo atiende a todos los visores
+    (en vez de un hilo OS por cliente en Werkzeug).
+
+    - Un hilo "feed" por (cámara, variante) espera al FrameBus UNA vez y reparte
+      el mismo part a todas las colas suscritas.
+    - Cada cliente tiene una cola corta: si se llena se descarta el frame más
+      viejo, así un cliente lento solo se pierde frames, no frena al resto.
+    - max_viewers acota los clientes (503 + Retry-After) y un drain() que supera
+      send_timeout desconecta al cliente atascado.
+    """
+
+    def __init__(self, host, port, max_viewers=20, queue_size=2, send_timeout=5.0):
+        self.host = host
+        self.port = port
+        self.max_viewers = max_viewers
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+
+        self.loop = None
+        self._feeds = {}
+        self._feeds_lock = threading.Lock()
+        self.viewers = 0
+        self.served = 0
+        self.rejected = 0
+        self.dropped_frames = 0
+        self.slow_disconnects = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name="async-stream", daemon=True).start()
+
+    def stats(self):
+        with self._feeds_lock:
+            feeds = len(self._feeds)
+        return {
+            "port": self.port,
+            "viewers": self.viewers,
+            "max_viewers": self.max_viewers,
+            "feeds": feeds,
+            "served": self.served,
+            "rejected": self.rejected,
+            "dropped_frames": self.dropped_frames,
+            "slow_disconnects": self.slow_disconnects
+        }
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[READY] Streaming asyncio en http://{self.host}:{self.port}/video_feed")
+        async with server:
+            await server.serve_forever()
+
+    # --------------------------------------------------------
+    # Reparto de frames (hilos feed → loop asyncio)
+    # --------------------------------------------------------
+    def _subscribe(self, key, worker, queue):
+        with self._feeds_lock:
+            subs = self._feeds.get(key)
+            if subs is None:
+                subs = self._feeds[key] = set()
+                threading.Thread(target=self._feed, args=(key, worker), daemon=True).start()
+            subs.add(queue)
+
+    def _unsubscribe(self, key, queue):
+        with self._feeds_lock:
+            subs = self._feeds.get(key)
+            if subs is not None:
+                subs.discard(queue)
+
+    def _feed(self, key, worker):
+        _, max_width, quality, changed_only = key
+        last_id = 0
+
+        while True:
+            with self._feeds_lock:
+                subs = self._feeds.get(key)
+                if not subs:
+                    self._feeds.pop(key, None)
+                    return
+                queues = list(subs)
+
+            packet = worker.bus.wait_next(last_id, timeout=FRAME_WAIT_TIMEOUT, changed_only=changed_only)
+            if packet is None:
+                continue
+
+            frame_id, part = worker.variants.get(packet, max_width, quality)
+            if part is None or frame_id <= last_id:
+                # Variante vencida: avanzar el cursor para bloquear hasta un frame más nuevo
+                last_id = max(last_id, packet.frame_id)
+                continue
+
+            last_id = frame_id
+            self.loop.call_soon_threadsafe(self._dispatch, queues, part)
+
+    def _dispatch(self, queues, part):
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()   # se descarta el frame viejo, nunca se bloquea
+                self.dropped_frames += 1
+            queue.put_nowait(part)
+
+    # --------------------------------------------------------
+    # HTTP mínimo
+    # --------------------------------------------------------
+    async def _reply(self, writer, status, body, extra_headers=""):
+        payload = json.dumps(body).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n{extra_headers}Connection: close\r\n\r\n".encode()
+            + payload
+        )
+        try:
+            await asyncio.wait_for(writer.drain(), self.send_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        try:
+            await self._route(head, writer)
+        finally:
+            writer.close()
+
+    async def _route(self, head, writer):
+        request_line = head.split(b"\r\n", 1)[0].decode("latin-1").split()
+        if len(request_line) < 2 or request_line[0] != "GET":
+            await self._reply(writer, "405 Method Not Allowed", {"error": "Solo GET"})
+            return
+
+        url = urllib.parse.urlsplit(request_line[1])
+        args = MultiDict(urllib.parse.parse_qsl(url.query))
+        segments = [seg for seg in url.path.split("/") if seg]
+
+        if segments == ["api", "v1", "status"]:
+            await self._reply(writer, "200 OK", self.stats())
+            return
+
+        if not segments or segments[0] != "video_feed" or len(segments) > 2:
+            await self._reply(writer, "404 Not Found", {"error": "Ruta no encontrada"})
+            return
+
+        worker = get_worker(segments[1] if len(segments) == 2 else None)
+        if worker is None:
+            await self._reply(writer, "404 Not Found", {"error": f"Cámara desconocida: {segments[1]}",
+                                                        "cameras": list(state["workers"])})
+            return
+
+        try:
+            profile = resolve_profile(args)
+        except ValueError as e:
+            await self._reply(writer, "400 Bad Request", {"error": str(e)})
+            return
+
+        if self.viewers >= self.max_viewers:
+            self.rejected += 1
+            await self._reply(writer, "503 Service Unavailable",
+                              {"error": "Máximo de visores alcanzado", "max_viewers": self.max_viewers},
+                              "Retry-After: 5\r\n")
+            return
+
+        changed_only = args.get("changed") in ("1", "true")
+        key = (worker.cam_id, profile["max_width"], profile["quality"], changed_only)
+        await self._stream(writer, key, worker, profile)
+
+    async def _stream(self, writer, key, worker, profile):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        min_interval = 1.0 / profile["fps"] if profile["fps"] else 0.0
+        next_due = 0.0
+
+        self.viewers += 1
+        self.served += 1
+        self._subscribe(key, worker, queue)
+
+        try:
+            writer.write(MJPEG_RESPONSE_HEAD)
+            await asyncio.wait_for(writer.drain(), self.send_timeout)
+
+            while True:
+                part = await queue.get()
+
+                # Tope de FPS: esperar y quedarse con el frame más nuevo de la cola
+                delay = next_due - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                while not queue.empty():
+                    part = queue.get_nowait()
+
+                writer.write(part)
+                try:
+                    await asyncio.wait_for(writer.drain(), self.send_timeout)
+                except asyncio.TimeoutError:
+                    self.slow_disconnects += 1
+                    return
+
+                next_due = self.loop.time() + min_interval
+
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._unsubscribe(key, queue)
+            self.viewers -= 1
 
 
 # ============================================================
 # RUTAS
 # ============================================================
+def camera_not_found(cam_id):
+    return jsonify({"error": f"Cámara desconocida: {cam_id}",
+                    "cameras": list(state["workers"])}), 404
+
+
 @app.route("/video_feed")
-def video_feed():
-    return Response(frame_generator(),
+@app.route("/video_feed/<cam_id>")
+def video_feed(cam_id=None):
+    worker = get_worker(cam_id)
+    if worker is None:
+        return camera_not_found(cam_id)
+
+    try:
+        profile = resolve_profile(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    changed_only = request.args.get("changed") in ("1", "true")
+
+    return Response(frame_generator(worker, profile, changed_only),
                     mimetype="multipart/x-mixed-replace; boundary=frame")
 
 
+@app.route("/snapshot")
+@app.route("/snapshot/<cam_id>")
+def snapshot(cam_id=None):
+    """
+    Último frame ya codificado, sin abrir un stream.
+    - Por defecto: bytes image/jpeg con ETag = frame_id (soporta If-None-Match → 304).
+    - ?format=json: imagen base64 + metadata.
+    - ?changed=1&after=<frame_id>&wait=<s>: espera el siguiente frame con
+      cambios posterior a after; si no llega en `wait` segundos → 204.
+    Acepta los mismos ?profile=, ?width= y ?quality= que /video_feed.
+    """
+    worker = get_worker(cam_id)
+    if worker is None:
+        return camera_not_found(cam_id)
+
+    try:
+        profile = resolve_profile(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if request.args.get("changed") in ("1", "true"):
+        after = request.args.get("after", 0, type=int)
+        wait = min(request.args.get("wait", 5.0, type=float), 30.0)
+        packet = worker.bus.wait_next(after, timeout=wait, changed_only=True)
+        if packet is None:
+            return Response(status=204)   # sin cambios (no es un GET condicional)
+    else:
+        packet = worker.bus.latest()
+
+    if packet is None:
+        return jsonify({"error": "Sin frame disponible"}), 503
+
+    etag = str(packet.frame_id)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    frame_id, jpeg = worker.variants.get_jpeg(packet, profile["max_width"], profile["quality"])
+    if jpeg is None:
+        packet = worker.bus.latest()
+        frame_id, jpeg = worker.variants.get_jpeg(packet, profile["max_width"], profile["quality"])
+    if jpeg is None:
+        return jsonify({"error": "Frame no disponible, reintentar"}), 503
+    captured_at = datetime.fromtimestamp(packet.captured_at, timezone.utc).isoformat()
+
+    if request.args.get("format") == "json":
+        resp = jsonify({
+            "image": base64.b64encode(jpeg).decode("utf-8"),
+            "metadata": {
+                "camera": worker.cam_id,
+                "frame_id": frame_id,
+                "captured_at": captured_at,
+                "captured_epoch": packet.captured_at,
+                "size_bytes": len(jpeg),
+                "change_score": packet.score,
+                "changed": packet.changed,
+                "format": "jpg"
+            }
+        })
+    else:
+        resp = Response(jpeg, mimetype="image/jpeg")
+        resp.headers["X-Camera-Id"] = worker.cam_id
+        resp.headers["X-Frame-Id"] = str(frame_id)
+        resp.headers["X-Capture-Timestamp"] = captured_at
+        resp.headers["X-Capture-Epoch"] = f"{packet.captured_at:.6f}"
+        resp.headers["X-Change-Score"] = "" if packet.score is None else str(packet.score)
+        resp.headers["X-Changed"] = "1" if packet.changed else "0"
+
+    resp.set_etag(str(frame_id))
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.route("/api/v1/clips", methods=["POST"])
+def create_clip():
+    """
+    Exporta una ventana del ring buffer.
+    Body: {"seconds": 10} (últimos N s) o {"start": epoch, "end": epoch};
+    "format": "mjpeg" (por defecto) o "avi"; "camera" (por defecto la primera).
+    """
+    data = request.get_json(silent=True) or {}
+
+    worker = get_worker(data.get("camera"))
+    if worker is None:
+        return camera_not_found(data.get("camera"))
+
+    fmt = data.get("format", "mjpeg")
+    if fmt not in ("mjpeg", "avi"):
+        return jsonify({"error": "format debe ser 'mjpeg' o 'avi'"}), 400
+
+    try:
+        if "start" in data:
+            start = float(data["start"])
+            end = float(data.get("end", time.time()))
+        else:
+            end = time.time()
+            start = end - float(data.get("seconds", worker.ring.max_seconds))
+    except (TypeError, ValueError):
+        return jsonify({"error": "start/end/seconds inválidos"}), 400
+
+    job = request_clip(worker, start, end, fmt)
+    if job is None:
+        return jsonify({"error": "No hay frames en la ventana pedida"}), 404
+
+    return jsonify(job), 202
+
+
+@app.route("/api/v1/clips/<clip_id>")
+def clip_status(clip_id):
+    with state["lock"]:
+        job = state["clips"].get(clip_id)
+        job = dict(job) if job else None
+
+    if job is None:
+        return jsonify({"error": "Clip no encontrado"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/v1/clips/<clip_id>/download")
+def clip_download(clip_id):
+    with state["lock"]:
+        job = state["clips"].get(clip_id)
+        job = dict(job) if job else None
+
+    if job is None:
+        return jsonify({"error": "Clip no encontrado"}), 404
+    if job["status"] != "done":
+        return jsonify({"error": f"Clip en estado {job['status']}"}), 409
+
+    mimetype = "video/x-msvideo" if job["format"] == "avi" else "multipart/x-mixed-replace; boundary=frame"
+    return send_file(job["path"], mimetype=mimetype, as_attachment=True,
+                     download_name=os.path.basename(job["path"]))
+
+
 @app.route("/api/v1/status")
 def status_api():
+    cameras = {cam_id: w.stats() for cam_id, w in state["workers"].items()}
+    default = next(iter(cameras.values()), {})
+
     return jsonify({
         "service": state["service_name"],
         "running": state["running"],
         "paused": state["paused"],
         "uptime_start": state["uptime_start"],
-        "last_error": state["last_error"],
-        "last_success": state["last_success"],
-        "has_frame": state["frame"] is not None,
-        "current_camera": state["camera_list"][state["current_cam_index"]]
+        # Campos de la cámara principal (compatibilidad con la GUI)
+        "last_error": default.get("last_error"),
+        "last_success": default.get("last_success"),
+        "has_frame": default.get("has_frame", False),
+        "frame_id": default.get("frame_id", 0),
+        "current_camera": default.get("current_device"),
+        "standby_camera": default.get("standby_device"),
+        "failover": default.get("failover"),
+        # Detalle por cámara
+        "cameras": cameras,
+        "async_stream": state["async_server"].stats() if state["async_server"] else None
     })
 
 
@@ -170,6 +1571,7 @@ def status_api():
 # ============================================================
 def run_service():
     state["config"] = load_config()
+    state["workers"] = build_workers(state["config"])
 
     start_camera()  # JAMÁS FALLA
 
@@ -177,6 +1579,17 @@ def run_service():
     host = cfg.get("host", "0.0.0.0")
     port = cfg.get("stream_port", 5000)
 
+    async_cfg = cfg.get("async_stream", {})
+    if async_cfg.get("enabled", False):
+        state["async_server"] = AsyncStreamServer(
+            host,
+            async_cfg.get("port", 5011),
+            max_viewers=async_cfg.get("max_viewers", 20),
+            queue_size=async_cfg.get("queue_size", 2),
+            send_timeout=async_cfg.get("send_timeout_sec", 5.0)
+        )
+        state["async_server"].start()
+
     print(f"[READY] Servicio iniciado en http://{host}:{port}")
 
     app.run(host=host, port=port, threaded=True)
@@ -0,0 +1,198 @@
+"""
+Benchmark: bytes copiados por segundo en la entrega de frames, con una fuente
+sintética y N clientes.
+
+- antes: réplica del esquema original del servicio (frame.copy() bajo lock en
+  camera_loop y, por cliente, frame.copy() + encode en cada iteración de
+  frame_generator). Las copias se cuentan donde se hacen.
+- después: el camino real (CameraWorker.capture_loop → FramePool → publish →
+  VariantCache → frame_generator). Se cuentan las copias que realmente ocurren:
+  frames que la fuente NO escribió en el buffer del FramePool, y parts
+  entregados que no son el mismo objeto compartido por VariantCache.
+
+El esquema original no tenía perfiles: --max-width solo aplica a "después".
+
+Uso:
+    python bench_copias_frame.py --width 1920 --height 1080 --fps 30 --viewers 3
+    python bench_copias_frame.py --viewers 3 --max-width 854
+"""
+import argparse
+import threading
+import time
+from collections import OrderedDict
+
+from app import CameraWorker, SyntheticSource, build_part, encode_frame, frame_generator
+
+
+class FuenteContada:
+    """Envuelve la fuente y cuenta los frames que no se escribieron en el buffer entregado."""
+
+    def __init__(self, source):
+        self.source = source
+        self.frames = 0
+        self.bytes_copiados = 0
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def grab(self):
+        return self.source.grab()
+
+    def release(self):
+        self.source.release()
+
+    def read(self, image=None):
+        ret, frame = self.source.read(image)
+        if ret:
+            self.frames += 1
+            if image is None or frame is not image:
+                self.bytes_copiados += frame.nbytes
+        return ret, frame
+
+
+class PartsCompartidos:
+    """
+    Por frame_id recuerda el primer part que devolvió VariantCache.get(): otro
+    objeto para el mismo frame, o un yield distinto de lo que devolvió get(),
+    es una copia.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._lock = threading.Lock()
+        self._parts = OrderedDict()
+        self.entregados = 0
+        self.bytes_copiados = 0
+
+    def entregar(self, part, frame_id, part_cache):
+        with self._lock:
+            self.entregados += 1
+            previo = self._parts.setdefault(frame_id, part_cache)
+            while len(self._parts) > self.size:
+                self._parts.popitem(last=False)
+            if part is not part_cache or previo is not part_cache:
+                self.bytes_copiados += len(part)
+
+
+def run_antes(args):
+    source = SyntheticSource(args.width, args.height, args.fps)
+    lock = threading.Lock()
+    shared = {"frame": None}
+    stop = threading.Event()
+    c = {"frames": 0, "captura": 0, "clientes": 0, "entregados": 0, "encodes": 0}
+
+    def camera_loop():
+        while not stop.is_set():
+            ret, frame = source.read()
+            if not ret:
+                continue
+            with lock:
+                shared["frame"] = frame.copy()
+                c["captura"] += frame.nbytes
+                c["frames"] += 1
+            time.sleep(0.03)
+
+    def viewer():
+        while not stop.is_set():
+            with lock:
+                frame = shared["frame"].copy() if shared["frame"] is not None else None
+                if frame is not None:
+                    c["clientes"] += frame.nbytes
+            if frame is None:
+                time.sleep(0.1)
+                continue
+            build_part(encode_frame(frame))
+            with lock:
+                c["encodes"] += 1
+                c["entregados"] += 1
+
+    threads = [threading.Thread(target=camera_loop)] + \
+        [threading.Thread(target=viewer) for _ in range(args.viewers)]
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    for t in threads:
+        t.join()
+
+    return {**c, "elapsed": elapsed, "cpu": cpu}
+
+
+def run_despues(args):
+    worker = CameraWorker("bench", ["synthetic"], {"frame_buffers": 3})
+    source = FuenteContada(SyntheticSource(args.width, args.height, args.fps))
+    worker.set_active("synthetic", source)
+    worker.running = True
+
+    profile = {"fps": None, "max_width": args.max_width, "quality": None}
+    parts = PartsCompartidos()
+
+    # Solo observa lo que VariantCache.get() devuelve a cada hilo (frame_id, part)
+    ultimo = threading.local()
+    variants_get = worker.variants.get
+
+    def get_observado(packet, max_width=None, quality=None):
+        ultimo.frame_id, ultimo.part = variants_get(packet, max_width, quality)
+        return ultimo.frame_id, ultimo.part
+
+    worker.variants.get = get_observado
+
+    def viewer():
+        # frame_generator termina solo cuando worker.running pasa a False
+        for part in frame_generator(worker, profile):
+            parts.entregar(part, ultimo.frame_id, ultimo.part)
+
+    threads = [threading.Thread(target=worker.capture_loop)] + \
+        [threading.Thread(target=viewer) for _ in range(args.viewers)]
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    worker.running = False
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    for t in threads:
+        t.join()
+
+    return {
+        "frames": source.frames,
+        "captura": source.bytes_copiados,
+        "clientes": parts.bytes_copiados,
+        "entregados": parts.entregados,
+        "encodes": worker.frames + worker.variants.encodes,
+        "elapsed": elapsed,
+        "cpu": cpu
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--viewers", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--max-width", type=int, help="Perfil con variante reducida (solo 'después')")
+    args = parser.parse_args()
+
+    print(f"{args.width}x{args.height} @ {args.fps} fps, {args.viewers} clientes, "
+          f"{args.seconds:.0f} s, perfil {'max_width=' + str(args.max_width) if args.max_width else 'full'}\n")
+    print(f"{'esquema':<10}{'fps':>7}{'encodes/s':>11}{'parts/s':>9}"
+          f"{'copia captura MB/s':>20}{'copia clientes MB/s':>21}{'CPU %':>7}")
+
+    for name, fn in (("antes", run_antes), ("después", run_despues)):
+        r = fn(args)
+        s = r["elapsed"]
+        print(f"{name:<10}{r['frames'] / s:>7.1f}{r['encodes'] / s:>11.1f}{r['entregados'] / s:>9.1f}"
+              f"{r['captura'] / s / 1e6:>20.1f}{r['clientes'] / s / 1e6:>21.1f}{r['cpu'] / s * 100:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
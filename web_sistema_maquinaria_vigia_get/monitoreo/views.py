@@ -118,10 +118,11 @@ def dashboard(request):
     # Snapshot
     snapshot = last_report.get("ruta_imagen_local") or "/static/img/no_image.png"
 
-    # Cámara
+    # Cámara: stream_host apunta al servidor asyncio de la cámara (async_stream, 5011)
+    # si está habilitado; vacío → el stream sale por el servidor Flask (5001)
     camera_cfg = settings.SERVICES_CONFIG.get("camera", {})
     camera_url = (
-        f"{camera_cfg.get('host', 'http://127.0.0.1:5001')}"
+        f"{camera_cfg.get('stream_host') or camera_cfg.get('host', 'http://127.0.0.1:5001')}"
         f"{camera_cfg.get('stream_route', '/video_feed')}"
     )
 